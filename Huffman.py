@@ -1,7 +1,18 @@
 from helpers import WriteBitStream, ReadBitStream
+from RLE import RLE_encode, RLE_decode
+from functools import lru_cache
+from typing import Iterable
+from numpy import frombuffer, uint8, int32, int64, bincount, flatnonzero, arange, array, zeros, empty, packbits, unpackbits
 import heapq
 
 
+HUFFMAN_TABLE_BITS = 11
+HUFFMAN_CACHE_SIZE = 256
+HUFFMAN_QUANTIZATION_BITS = 3
+HUFFMAN_QUANTIZATION_TOTAL = 2 ** 12
+HUFFMAN_QUANTIZATION_MAX_SIZE = 2 ** 14
+STATIC_TABLE_ID_SIZE_BYTES = 2
+
 class HuffmanNode:
     @staticmethod
     def create_leaf(symbol: str, weight: int):
@@ -124,10 +135,164 @@ class HuffmanCodeIterator:
         
 
 
-def huffman_encode(data: bytes) -> bytes:
+class HuffmanDecodeTable:
+    def __init__(self, code_dict: dict, table_bits: int = HUFFMAN_TABLE_BITS):
+        if not code_dict:
+            raise ValueError("Code dictionary cannot be empty")
+
+        self.max_length = max(len(code) for code in code_dict.values())
+        self.table_bits = min(table_bits, self.max_length)
+
+        # Codes are written first bit first into an LSB-first stream, so a code
+        # is matched by the low bits of the window in reversed order. Every
+        # window starting with a short code maps to (length << 8) | symbol;
+        # windows starting with a longer code map to 0 and are resolved in
+        # long_codes by (length, reversed code).
+        self.table = [0] * (1 << self.table_bits)
+        self.long_codes = {}
+
+        for symbol, code in code_dict.items():
+            length = len(code)
+            if length == 0:
+                raise ValueError("Code length must be positive")
+
+            r = 0
+            for i, bit in enumerate(code):
+                r |= bit << i
+
+            if length <= self.table_bits:
+                entry = (length << 8) | symbol
+                for w in range(r, 1 << self.table_bits, 1 << length):
+                    self.table[w] = entry
+            else:
+                self.long_codes[(length, r)] = symbol
+
+    def decode(self, data: bytes, start: int, N: int) -> bytes:
+        out = bytearray(N)
+        self.decode_into(data, out, 0, N, 0, 0, start)
+
+        return bytes(out)
+
+    # Decodes symbols into out[begin:end] from the bit reader state (acc,
+    # n_bits, j): acc holds n_bits not yet consumed bits, LSB first, and j is
+    # the next byte of data to load. Returns the state after the last symbol,
+    # so streams that switch tables can carry it from one call to the next.
+    def decode_into(self, data: bytes, out: bytearray, begin: int, end: int, acc: int, n_bits: int, j: int) -> tuple:
+        table = self.table
+        long_codes = self.long_codes
+        table_bits = self.table_bits
+        max_length = self.max_length
+        mask = (1 << table_bits) - 1
+        D = len(data)
+
+        for n in range(begin, end):
+            while n_bits < max_length and j < D:
+                chunk = data[j:j+32]
+                acc |= int.from_bytes(chunk, byteorder='little') << n_bits
+                n_bits += 8 * len(chunk)
+                j += len(chunk)
+
+            entry = table[acc & mask]
+            if entry:
+                length = entry >> 8
+                symbol = entry & 255
+            else:
+                length = table_bits + 1
+                while (length, acc & ((1 << length) - 1)) not in long_codes:
+                    length += 1
+                    if length > max_length:
+                        raise ValueError("Invalid Huffman code")
+                symbol = long_codes[(length, acc & ((1 << length) - 1))]
+
+            if length > n_bits:
+                raise RuntimeError("EOS")
+
+            out[n] = symbol
+            acc >>= length
+            n_bits -= length
+
+        return acc, n_bits, j
+
+
+
+def code_dict_to_ints(code_dict: dict) -> tuple:
+    values = [0] * 256
+    lengths = [0] * 256
+
+    for symbol, code in code_dict.items():
+        for bit in code:
+            values[symbol] = (values[symbol] << 1) | bit
+        lengths[symbol] = len(code)
+
+    return values, lengths
+
+
+def code_length_stats(frequency_dict: dict, code_lengths: list, stats: dict):
+    n_symbols = sum(frequency_dict.values())
+    n_bits = sum(freq * code_lengths[symbol] for symbol, freq in frequency_dict.items())
+
+    stats["average_code_length"] = n_bits / n_symbols if n_symbols > 0 else 0.0
+    stats["max_code_length"] = max(code_lengths)
+
+
+# Building the tree, the code dictionary and the decode table costs about as
+# much as coding a few kilobytes, so for small messages it dominates. Tables
+# are kept in bounded LRU caches: the legacy format stores exact frequencies,
+# so its tables are keyed by them; canonical codes only need to be decodable
+# from the stored lengths, so they are derived from the histogram scaled to
+# HUFFMAN_QUANTIZATION_TOTAL and cut to its top HUFFMAN_QUANTIZATION_BITS bits
+# per symbol, and similarly distributed messages share one set of lengths.
+# Symbols that occur keep a nonzero count. Messages longer than
+# HUFFMAN_QUANTIZATION_MAX_SIZE use exact lengths: for them building the table
+# is cheap next to coding, and quantizing would cost ratio for nothing.
+# Cached tables must not be modified.
+def quantize_frequencies(frequency_dict: dict) -> tuple:
+    N = sum(frequency_dict.values())
+
+    quantized = []
+    for b in range(256):
+        freq = frequency_dict.get(b, 0)
+        if freq > 0:
+            freq = max(freq * HUFFMAN_QUANTIZATION_TOTAL // N, 1)
+            shift = max(freq.bit_length() - HUFFMAN_QUANTIZATION_BITS, 0)
+            freq = (freq >> shift) << shift
+        quantized.append(freq)
+
+    return tuple(quantized)
+
+
+@lru_cache(maxsize=HUFFMAN_CACHE_SIZE)
+def tree_code_table(frequencies: tuple) -> tuple:
+    code_dict = build_huffman_tree(dict(enumerate(frequencies))).get_code_dict(tuple())
+    values, lengths = code_dict_to_ints(code_dict)
+
+    return tuple(values), tuple(lengths)
+
+
+@lru_cache(maxsize=HUFFMAN_CACHE_SIZE)
+def tree_decode_table(frequencies: tuple):
+    return HuffmanDecodeTable(build_huffman_tree(dict(enumerate(frequencies))).get_code_dict(tuple()))
+
+
+@lru_cache(maxsize=HUFFMAN_CACHE_SIZE)
+def quantized_code_lengths(frequencies: tuple, max_length: int | None) -> tuple:
+    return tuple(huffman_code_lengths(dict(enumerate(frequencies)), max_length))
+
+
+@lru_cache(maxsize=HUFFMAN_CACHE_SIZE)
+def canonical_code_table(lengths: tuple) -> tuple:
+    values, code_lengths = code_dict_to_ints(canonical_huffman_codes(lengths))
+
+    return tuple(values), tuple(code_lengths)
+
+
+@lru_cache(maxsize=HUFFMAN_CACHE_SIZE)
+def canonical_decode_table(lengths: tuple):
+    return HuffmanDecodeTable(canonical_huffman_codes(lengths))
+
+
+def huffman_encode(data: bytes, stats: dict | None = None) -> bytes:
     freq = count_byte_frequencies(data)
-    h_tree = build_huffman_tree(freq)
-    code_dict = h_tree.get_code_dict(tuple())
 
     ws = WriteBitStream()
 
@@ -138,10 +303,12 @@ def huffman_encode(data: bytes) -> bytes:
 
     ws.write_bytes(int.to_bytes(len(data), length=4, byteorder='big'))    
 
+    code_values, code_lengths = tree_code_table(tuple(freq.values()))
     for b in data:
-        code = code_dict[b]
-        ws.write_bits(code)
+        ws.write_bits(code_values[b], code_lengths[b])
 
+    if stats is not None:
+        code_length_stats(freq, code_lengths, stats)
     
     return ws.get_data()
 
@@ -161,17 +328,428 @@ def huffman_decode(data: bytes) -> bytes:
 
     N = int.from_bytes(rs.read_bytes(4), byteorder='big')
 
-    h_tree = build_huffman_tree(freq)
-    code = HuffmanCodeIterator(h_tree)
+    table = tree_decode_table(tuple(freq.values()))
 
-    B = bytearray()
+    return table.decode(data, rs.j, N)
 
-    for _ in range(N):
-        symbol = None
-        while symbol is None:
-            bit = rs.read_bit()
-            symbol = code.read_bit(bit)
-        
-        B.append(symbol)
-    
-    return bytes(B)
\ No newline at end of file
+
+def package_merge_code_lengths(frequency_dict: dict, max_length: int) -> dict:
+    symbols = sorted((freq, symbol) for symbol, freq in frequency_dict.items())
+    n = len(symbols)
+
+    if n == 0:
+        return {}
+    if n == 1:
+        return {symbols[0][1]: 1}
+    if (1 << max_length) < n:
+        raise ValueError(f"Cannot code {n} symbols with at most {max_length} bits")
+
+    # Each item is (weight, symbols it contains). Packaging pairs of items and
+    # merging them back with the leaves max_length - 1 times, then taking the
+    # 2n - 2 cheapest items, gives the optimal lengths bounded by max_length:
+    # a symbol's code length is the number of chosen items containing it.
+    leaves = [(freq, (symbol,)) for freq, symbol in symbols]
+    items = leaves
+    for _ in range(max_length - 1):
+        packages = [(a[0] + b[0], a[1] + b[1]) for a, b in zip(items[0::2], items[1::2])]
+        items = sorted(leaves + packages, key=lambda item: item[0])
+
+    lengths = {symbol: 0 for _, symbol in symbols}
+    for _, item_symbols in items[:2 * n - 2]:
+        for symbol in item_symbols:
+            lengths[symbol] += 1
+
+    return lengths
+
+
+def huffman_code_lengths(frequency_dict: dict, max_length: int | None = None) -> list:
+    lengths = [0] * 256
+
+    present = {symbol: freq for symbol, freq in frequency_dict.items() if freq > 0}
+    if not present:
+        return lengths
+
+    if max_length is not None:
+        if not (1 <= max_length <= 255):
+            raise ValueError("Maximum code length must be in range [1, 255]")
+
+        for symbol, length in package_merge_code_lengths(present, max_length).items():
+            lengths[symbol] = length
+
+        return lengths
+
+    code_dict = build_huffman_tree(present).get_code_dict(tuple())
+    for symbol, code in code_dict.items():
+        lengths[symbol] = max(len(code), 1)
+
+    return lengths
+
+
+def canonical_huffman_codes(lengths: list) -> dict:
+    code_dict = {}
+
+    code = 0
+    prev_length = 0
+    for length, symbol in sorted((l, s) for s, l in enumerate(lengths) if l > 0):
+        code <<= (length - prev_length)
+        if code >= (1 << length):
+            raise ValueError("Code lengths do not form a prefix code")
+
+        code_dict[symbol] = tuple(bool((code >> k) & 1) for k in range(length - 1, -1, -1))
+        code += 1
+        prev_length = length
+
+    return code_dict
+
+
+def canonical_huffman_encode(data: bytes, max_code_length: int | None = None, stats: dict | None = None) -> bytes:
+    freq = count_byte_frequencies(data)
+    if len(data) <= HUFFMAN_QUANTIZATION_MAX_SIZE:
+        lengths = quantized_code_lengths(quantize_frequencies(freq), max_code_length)
+    else:
+        lengths = tuple(huffman_code_lengths(freq, max_code_length))
+    table = RLE_encode(bytes(lengths))
+
+    ws = WriteBitStream()
+
+    ws.write_bytes(int.to_bytes(len(data), length=4, byteorder='big'))
+    ws.write_bytes(int.to_bytes(len(table), length=2, byteorder='big'))
+    ws.write_bytes(table)
+
+    code_values, code_lengths = canonical_code_table(lengths)
+    for b in data:
+        ws.write_bits(code_values[b], code_lengths[b])
+
+    if stats is not None:
+        code_length_stats(freq, code_lengths, stats)
+
+    return ws.get_data()
+
+
+def canonical_huffman_decode(data: bytes) -> bytes:
+    if len(data) < 6:
+        raise ValueError("Incorrect canonical Huffman header format")
+
+    N = int.from_bytes(data[:4], byteorder='big')
+    table_size = int.from_bytes(data[4:6], byteorder='big')
+
+    lengths = RLE_decode(data[6:6+table_size])
+    if len(lengths) != 256:
+        raise ValueError("Incorrect canonical Huffman code length table")
+
+    if N == 0:
+        return bytes()
+
+    table = canonical_decode_table(tuple(lengths))
+
+    return table.decode(data, 6 + table_size, N)
+
+
+# Static tables are trained once for a class of messages, registered under the
+# same ID on both sides and referenced by that ID instead of being stored with
+# every message. Registered tables are pinned: they never leave the registry.
+STATIC_HUFFMAN_TABLES = {}
+
+
+def train_huffman_table(samples: Iterable[bytes], max_code_length: int | None = None) -> bytes:
+    freq = {b: 1 for b in range(256)}
+    for sample in samples:
+        for b, f in count_byte_frequencies(sample).items():
+            freq[b] += f
+
+    return bytes(huffman_code_lengths(freq, max_code_length))
+
+
+def register_huffman_table(table_id: int, lengths: bytes):
+    if not (0 <= table_id < 2 ** (8 * STATIC_TABLE_ID_SIZE_BYTES)):
+        raise ValueError(f"Huffman table ID must be in range [0, {2 ** (8 * STATIC_TABLE_ID_SIZE_BYTES)})")
+
+    lengths = tuple(lengths)
+    if len(lengths) != 256 or not any(lengths):
+        raise ValueError("Huffman table must have 256 code lengths, not all zero")
+
+    if table_id in STATIC_HUFFMAN_TABLES:
+        if STATIC_HUFFMAN_TABLES[table_id][0] != lengths:
+            raise ValueError(f"A different Huffman table is already registered with ID {table_id}")
+        return
+
+    code_dict = canonical_huffman_codes(lengths)
+    code_values, code_lengths = code_dict_to_ints(code_dict)
+    STATIC_HUFFMAN_TABLES[table_id] = (lengths, code_values, code_lengths, HuffmanDecodeTable(code_dict))
+
+
+def registered_huffman_tables() -> dict:
+    return {table_id: entry[0] for table_id, entry in STATIC_HUFFMAN_TABLES.items()}
+
+
+# Worker processes started with spawn begin with an empty registry; the pool
+# hands them the parent's tables through this initializer.
+def register_huffman_tables(tables: dict):
+    for table_id, lengths in tables.items():
+        register_huffman_table(table_id, lengths)
+
+
+def static_huffman_table(table_id: int) -> tuple:
+    if table_id not in STATIC_HUFFMAN_TABLES:
+        raise ValueError(f"No Huffman table registered with ID {table_id}")
+
+    return STATIC_HUFFMAN_TABLES[table_id]
+
+
+def static_huffman_encode(data: bytes, table_id: int, stats: dict | None = None) -> bytes:
+    _, code_values, code_lengths, _ = static_huffman_table(table_id)
+
+    ws = WriteBitStream()
+
+    ws.write_bytes(int.to_bytes(table_id, length=STATIC_TABLE_ID_SIZE_BYTES, byteorder='big'))
+    ws.write_bytes(int.to_bytes(len(data), length=4, byteorder='big'))
+
+    for b in data:
+        if code_lengths[b] == 0:
+            raise ValueError(f"Huffman table {table_id} has no code for byte {b}")
+        ws.write_bits(code_values[b], code_lengths[b])
+
+    if stats is not None:
+        code_length_stats(count_byte_frequencies(data), code_lengths, stats)
+
+    return ws.get_data()
+
+
+def static_huffman_decode(data: bytes) -> bytes:
+    header_size = STATIC_TABLE_ID_SIZE_BYTES + 4
+    if len(data) < header_size:
+        raise ValueError("Incorrect static Huffman header format")
+
+    table_id = int.from_bytes(data[:STATIC_TABLE_ID_SIZE_BYTES], byteorder='big')
+    N = int.from_bytes(data[STATIC_TABLE_ID_SIZE_BYTES:header_size], byteorder='big')
+
+    table = static_huffman_table(table_id)[3]
+    if N == 0:
+        return bytes()
+
+    return table.decode(data, header_size, N)
+
+
+MULTI_TABLE_GROUP_SIZE = 50
+MULTI_TABLE_MIN_TABLES = 2
+MULTI_TABLE_MAX_TABLES = 6
+MULTI_TABLE_ITERATIONS = 4
+MULTI_TABLE_MAX_CODE_LENGTH = 17
+MULTI_TABLE_WINDOW_GROUPS = 2 ** 12
+
+
+def default_table_count(N: int) -> int:
+    if N < 200:
+        return 2
+    if N < 600:
+        return 3
+    if N < 1200:
+        return 4
+    if N < 2400:
+        return 5
+    return 6
+
+
+def initial_table_lengths(freq, symbols: list, n_tables: int) -> list:
+    # Split the used symbols into n_tables ranges of roughly equal total
+    # frequency, each table favouring its own range.
+    tables = []
+
+    remaining = int(freq.sum())
+    beg = 0
+    for n_part in range(n_tables, 0, -1):
+        target = remaining / n_part
+        end = beg - 1
+        acc = 0
+        while acc < target and end < len(symbols) - 1:
+            end += 1
+            acc += int(freq[symbols[end]])
+
+        if end > beg and n_part != n_tables and n_part != 1 and (n_tables - n_part) % 2 == 1:
+            acc -= int(freq[symbols[end]])
+            end -= 1
+
+        lengths = zeros(256, dtype=int64)
+        lengths[symbols] = 15
+        lengths[symbols[beg:end+1]] = 0
+        tables.append(lengths)
+
+        beg = end + 1
+        remaining -= acc
+
+    return tables[::-1]
+
+
+def group_histograms(a, symbols, group_size: int):
+    # hist[g, k] counts symbols[k] in group g. Counts never exceed group_size,
+    # so they fit in a byte, and the index arrays only span one window.
+    n_symbols = len(symbols)
+    symbol_index = zeros(256, dtype=int32)
+    symbol_index[symbols] = arange(n_symbols, dtype=int32)
+
+    n_groups = (len(a) + group_size - 1) // group_size
+    hist = zeros((n_groups, n_symbols), dtype=uint8)
+
+    W = MULTI_TABLE_WINDOW_GROUPS
+    for g in range(0, n_groups, W):
+        chunk = a[g * group_size:(g + W) * group_size]
+        rows = (len(chunk) + group_size - 1) // group_size
+        keys = (arange(len(chunk), dtype=int32) // group_size) * n_symbols + symbol_index[chunk]
+        hist[g:g+rows] = bincount(keys, minlength=rows * n_symbols).reshape(rows, n_symbols)
+
+    return hist
+
+
+def group_costs(hist, tables, symbols):
+    # Bits every table would spend on every group
+    lengths = array(tables)[:, symbols].T
+
+    costs = empty((hist.shape[0], len(tables)), dtype=int64)
+    W = MULTI_TABLE_WINDOW_GROUPS
+    for g in range(0, hist.shape[0], W):
+        costs[g:g+W] = hist[g:g+W].astype(int64) @ lengths
+
+    return costs
+
+
+# Like bzip2: the input is cut into groups of group_size symbols and every
+# group is coded with whichever of n_tables code tables suits it best. Starting
+# from tables that each favour a slice of the alphabet, every iteration assigns
+# each group its cheapest table and rebuilds every table from the symbols of
+# the groups assigned to it. Selectors are move-to-front coded in unary, and
+# code lengths are delta coded over the used symbols.
+def multi_table_huffman_encode(data: bytes, n_tables: int | None = None, group_size: int = MULTI_TABLE_GROUP_SIZE,
+                               n_iterations: int = MULTI_TABLE_ITERATIONS, stats: dict | None = None) -> bytes:
+    N = len(data)
+    if n_tables is None:
+        n_tables = default_table_count(N)
+    if not (MULTI_TABLE_MIN_TABLES <= n_tables <= MULTI_TABLE_MAX_TABLES):
+        raise ValueError(f"Number of tables must be in range [{MULTI_TABLE_MIN_TABLES}, {MULTI_TABLE_MAX_TABLES}]")
+    if not (1 <= group_size <= 255):
+        raise ValueError("Group size must be in range [1, 255]")
+
+    ws = WriteBitStream()
+    ws.write_bytes(int.to_bytes(N, length=4, byteorder='big'))
+    ws.write_bytes(bytes([n_tables, group_size]))
+
+    if N == 0:
+        return ws.get_data()
+
+    a = frombuffer(data, dtype=uint8)
+    freq = bincount(a, minlength=256)
+    symbols = flatnonzero(freq)
+
+    n_groups = (N + group_size - 1) // group_size
+    hist = group_histograms(a, symbols, group_size)
+
+    tables = initial_table_lengths(freq, symbols, n_tables)
+    for _ in range(n_iterations):
+        selectors = group_costs(hist, tables, symbols).argmin(axis=1)
+
+        table_freq = zeros((n_tables, len(symbols)), dtype=int64)
+        for g in range(0, n_groups, MULTI_TABLE_WINDOW_GROUPS):
+            window = hist[g:g+MULTI_TABLE_WINDOW_GROUPS]
+            window_selectors = selectors[g:g+MULTI_TABLE_WINDOW_GROUPS]
+            for t in range(n_tables):
+                table_freq[t] += window[window_selectors == t].sum(axis=0, dtype=int64)
+
+        tables = []
+        for t in range(n_tables):
+            f = {int(s): int(table_freq[t, k]) + 1 for k, s in enumerate(symbols)}
+            tables.append(array(huffman_code_lengths(f, MULTI_TABLE_MAX_CODE_LENGTH), dtype=int64))
+
+    costs = group_costs(hist, tables, symbols)
+    selectors = costs.argmin(axis=1).tolist()
+
+    used = zeros(256, dtype=uint8)
+    used[symbols] = 1
+    ws.write_bytes(packbits(used).tobytes())
+
+    order = list(range(n_tables))
+    for t in selectors:
+        j = order.index(t)
+        ws.write_bits((1 << (j + 1)) - 2, j + 1)
+        del order[j]
+        order.insert(0, t)
+
+    code_tables = []
+    for lengths in tables:
+        lengths = tuple(lengths.tolist())
+        code_tables.append(canonical_code_table(lengths))
+
+        current = lengths[symbols[0]]
+        ws.write_bits(current, 5)
+        for s in symbols.tolist():
+            while current != lengths[s]:
+                ws.write_bits(0b10 if current < lengths[s] else 0b11, 2)
+                current += 1 if current < lengths[s] else -1
+            ws.write_bits(0, 1)
+
+    for g in range(n_groups):
+        code_values, code_lengths = code_tables[selectors[g]]
+        for b in data[g * group_size:(g + 1) * group_size]:
+            ws.write_bits(code_values[b], code_lengths[b])
+
+    if stats is not None:
+        stats["tables"] = n_tables
+        stats["average_code_length"] = float(costs.min(axis=1).sum()) / N
+        stats["max_code_length"] = int(max(max(lengths) for lengths in tables))
+
+    return ws.get_data()
+
+
+def multi_table_huffman_decode(data: bytes) -> bytes:
+    if len(data) < 6:
+        raise ValueError("Incorrect multi-table Huffman header format")
+
+    rs = ReadBitStream(data)
+    N = int.from_bytes(rs.read_bytes(4), byteorder='big')
+    n_tables = rs.read_byte()
+    group_size = rs.read_byte()
+
+    if N == 0:
+        return bytes()
+
+    if not (MULTI_TABLE_MIN_TABLES <= n_tables <= MULTI_TABLE_MAX_TABLES) or group_size == 0:
+        raise ValueError("Incorrect multi-table Huffman header format")
+
+    symbols = flatnonzero(unpackbits(frombuffer(rs.read_bytes(32), dtype=uint8))).tolist()
+    if not symbols:
+        raise ValueError("Incorrect multi-table Huffman symbol map")
+
+    n_groups = (N + group_size - 1) // group_size
+    selectors = []
+    order = list(range(n_tables))
+    for _ in range(n_groups):
+        j = 0
+        while rs.read_bit():
+            j += 1
+            if j >= n_tables:
+                raise ValueError("Invalid multi-table Huffman selector")
+        t = order.pop(j)
+        order.insert(0, t)
+        selectors.append(t)
+
+    decode_tables = []
+    for _ in range(n_tables):
+        lengths = [0] * 256
+        current = rs.read_bits_int(5)
+        for s in symbols:
+            while rs.read_bit():
+                current += -1 if rs.read_bit() else 1
+            if not (1 <= current <= MULTI_TABLE_MAX_CODE_LENGTH):
+                raise ValueError("Invalid multi-table Huffman code length")
+            lengths[s] = current
+        decode_tables.append(canonical_decode_table(tuple(lengths)))
+
+    out = bytearray(N)
+    j = rs.pos // 8
+    acc = data[j] >> (rs.pos % 8)
+    n_bits = 8 - rs.pos % 8
+    j += 1
+
+    for g in range(n_groups):
+        acc, n_bits, j = decode_tables[selectors[g]].decode_into(data, out, g * group_size,
+                                                                 min(N, (g + 1) * group_size), acc, n_bits, j)
+
+    return bytes(out)
@@ -1,6 +1,15 @@
-from helpers import WriteBitStream, ReadBitStream, int_to_bits, bits_to_int
+from array import array
+from typing import Iterable
+from helpers import WriteBitStream, ReadBitStream
+import zlib
 
 MAX_DICT_SIZE = 2 ** 16
+MAX_CODE_WIDTH = 16
+MIN_CODE_WIDTH_LIMIT = 9
+MAX_CODE_WIDTH_LIMIT = 24
+RESET_CHECK_INTERVAL = 10000
+DICTIONARY_MAGIC = b'LZWD'
+DICTIONARY_SIZE = 2 ** 12
 
 class IRWayTrie:
     class IRWayTrieNode:
@@ -16,10 +25,20 @@ class IRWayTrie:
             self.children[char] = IRWayTrie.IRWayTrieNode(index)
 
 
-    def __init__(self):
+    def __init__(self, max_dict_size: int = MAX_DICT_SIZE, dictionary=None):
         self.root = self.IRWayTrieNode(None)
         self.root.children = {i: IRWayTrie.IRWayTrieNode(i) for i in range(256)}
         self.n_phrases = 256
+        self.max_dict_size = max_dict_size
+
+        if dictionary is not None:
+            dictionary.check_size(max_dict_size)
+
+            nodes = list(self.root.children.values())
+            for prefix, char in zip(dictionary.prefixes, dictionary.chars):
+                nodes[prefix].add_child(char, self.n_phrases)
+                nodes.append(nodes[prefix].children[char])
+                self.n_phrases += 1
 
         self.current_node = self.root
 
@@ -33,7 +52,7 @@ class IRWayTrie:
             return None
         
         else:
-            if self.n_phrases < MAX_DICT_SIZE - 1:
+            if self.n_phrases < self.max_dict_size - 1:
                 self.current_node.add_child(char, self.n_phrases)
                 self.n_phrases += 1
             idx = self.current_node.index
@@ -41,6 +60,48 @@ class IRWayTrie:
             
             return idx
 
+    @property
+    def current_index(self):
+        return self.current_node.index
+
+
+class FlatTrie:
+    # Same phrase numbering as IRWayTrie, but the whole trie is one dict mapping
+    # (prefix_code << 8) | char to the phrase code, so no per-phrase objects.
+    def __init__(self, max_dict_size: int = MAX_DICT_SIZE, dictionary=None):
+        self.codes = {}
+        self.n_phrases = 256
+        self.max_dict_size = max_dict_size
+
+        if dictionary is not None:
+            dictionary.check_size(max_dict_size)
+            self.codes = dictionary.codes.copy()
+            self.n_phrases += len(dictionary)
+
+        self.current_index = None
+
+    def next(self, char: int):
+        if self.current_index is None:
+            self.current_index = char
+
+            return None
+
+        key = (self.current_index << 8) | char
+        code = self.codes.get(key)
+
+        if code is not None:
+            self.current_index = code
+
+            return None
+
+        if self.n_phrases < self.max_dict_size - 1:
+            self.codes[key] = self.n_phrases
+            self.n_phrases += 1
+        idx = self.current_index
+        self.current_index = char
+
+        return idx
+
 
 class IDict:
     def __init__(self):
@@ -62,54 +123,272 @@ class IDict:
         
         self.prev_phrase = phrase
         return phrase
-    
 
 
-def lzw_compress(data: bytes) -> bytes:
-    trie = IRWayTrie()
+class OffsetIDict:
+    # Every phrase added to the dictionary is the previous phrase plus the first
+    # byte of the current one, which is exactly where it already lies in the
+    # decoded output. Entries are therefore (offset, length) pairs into the
+    # output, and memory is bounded by the dictionary size. A preset dictionary
+    # is entered the same way: its phrase buffer must be at the start of output.
+    def __init__(self, max_dict_size: int = MAX_DICT_SIZE, dictionary=None):
+        self.offsets = array('Q')
+        self.lengths = array('L')
+        self.n_phrases = 256
+        self.max_dict_size = max_dict_size
+
+        if dictionary is not None:
+            dictionary.check_size(max_dict_size)
+            self.offsets = array('Q', dictionary.offsets)
+            self.lengths = array('L', dictionary.lengths)
+            self.n_phrases += len(dictionary)
+
+        self.prev_offset = None
+        self.prev_length = 0
+
+    def next(self, index: int, output: bytearray):
+        offset = len(output)
+
+        if index < 256:
+            output.append(index)
+            length = 1
+
+        elif index < self.n_phrases:
+            o = self.offsets[index - 256]
+            length = self.lengths[index - 256]
+            output.extend(output[o:o+length])
+
+        elif (index == self.n_phrases) and (self.prev_offset is not None):
+            o = self.prev_offset
+            output.extend(output[o:o+self.prev_length])
+            output.append(output[o])
+            length = self.prev_length + 1
+
+        else:
+            raise ValueError("Invalid index")
+
+        if not (self.prev_offset is None) and (self.n_phrases < self.max_dict_size-1):
+            self.offsets.append(self.prev_offset)
+            self.lengths.append(self.prev_length + 1)
+            self.n_phrases += 1
+
+        self.prev_offset = offset
+        self.prev_length = length
+
+
+
+# A preset dictionary holds the phrases after the 256 single bytes as
+# (prefix code, byte) pairs, numbered from 256 in order, so every prefix comes
+# before the phrases extending it. The FlatTrie codes and the OffsetIDict
+# phrase buffer are built once here; each call only copies them.
+class LZWDictionary:
+    def __init__(self, prefixes: Iterable[int], chars: Iterable[int]):
+        self.prefixes = array('L', prefixes)
+        self.chars = bytes(chars)
+
+        if len(self.prefixes) != len(self.chars):
+            raise ValueError("Dictionary prefixes and bytes must have the same length")
+
+        self.codes = {}
+        self.offsets = array('Q')
+        self.lengths = array('L')
+        buffer = bytearray()
+
+        for k, (prefix, char) in enumerate(zip(self.prefixes, self.chars)):
+            if prefix >= 256 + k:
+                raise ValueError("Dictionary phrase refers to a later phrase")
+            self.codes[(prefix << 8) | char] = 256 + k
+
+            # A phrase extending the one just written only needs its last byte.
+            if k > 0 and prefix == 256 + k - 1:
+                offset = self.offsets[-1]
+                buffer.append(char)
+            else:
+                offset = len(buffer)
+                if prefix < 256:
+                    buffer.append(prefix)
+                else:
+                    o = self.offsets[prefix - 256]
+                    buffer.extend(buffer[o:o+self.lengths[prefix - 256]])
+                buffer.append(char)
+
+            self.offsets.append(offset)
+            self.lengths.append(len(buffer) - offset)
+
+        self.buffer = bytes(buffer)
+        self.crc = zlib.crc32(self.serialize())
+
+    def __len__(self) -> int:
+        return len(self.chars)
+
+    def __repr__(self) -> str:
+        return f"LZWDictionary(crc32={self.crc:08x})"
+
+    def check_size(self, max_dict_size: int):
+        if 256 + len(self) > max_dict_size - 1:
+            raise ValueError("Dictionary does not fit in the code width")
+
+    def serialize(self) -> bytes:
+        out = bytearray(DICTIONARY_MAGIC)
+        out.extend(len(self).to_bytes(4, byteorder='big'))
+        for prefix, char in zip(self.prefixes, self.chars):
+            out.extend(prefix.to_bytes(3, byteorder='big'))
+            out.append(char)
+
+        return bytes(out)
+
+    @staticmethod
+    def deserialize(data: bytes):
+        if bytes(data[:4]) != DICTIONARY_MAGIC:
+            raise ValueError("Data does not start with required LZWD header")
+
+        n = int.from_bytes(data[4:8], byteorder='big')
+        if len(data) != 8 + 4 * n:
+            raise ValueError("Data length does not match LZW dictionary header")
+
+        prefixes = [int.from_bytes(data[i:i+3], byteorder='big') for i in range(8, 8 + 4 * n, 4)]
+        chars = data[11:8 + 4 * n:4]
+
+        return LZWDictionary(prefixes, chars)
+
+
+# Training parses the samples with a growing dictionary, counts how often each
+# phrase is emitted and credits every phrase with the uses of its extensions.
+# The max_phrases most used phrases are kept; a prefix is used at least as
+# often as its extensions and has a smaller code, so the kept set stays closed
+# under prefixes.
+def train_lzw_dictionary(samples: Iterable[bytes], max_phrases: int = DICTIONARY_SIZE,
+                         max_code_width: int = MAX_CODE_WIDTH) -> LZWDictionary:
+    check_code_width(max_code_width)
+    max_phrases = min(max_phrases, 2 ** max_code_width - 1 - 256)
+
+    trie = FlatTrie(2 ** max_code_width)
+    uses = {}
+    for sample in samples:
+        for byte in sample:
+            idx = trie.next(byte)
+            if idx is not None:
+                uses[idx] = uses.get(idx, 0) + 1
+        if trie.current_index is not None:
+            uses[trie.current_index] = uses.get(trie.current_index, 0) + 1
+            trie.current_index = None
+
+    parents = {code: key for key, code in trie.codes.items()}
+    total = {}
+    for code in sorted(parents, reverse=True):
+        total[code] = total.get(code, 0) + uses.get(code, 0)
+        prefix = parents[code] >> 8
+        if prefix >= 256:
+            total[prefix] = total.get(prefix, 0) + total[code]
+
+    kept = sorted(sorted(parents, key=lambda code: (-total[code], code))[:max_phrases])
+    renumber = {code: 256 + k for k, code in enumerate(kept)}
+
+    prefixes = []
+    chars = []
+    for code in kept:
+        prefix = parents[code] >> 8
+        prefixes.append(renumber.get(prefix, prefix))
+        chars.append(parents[code] & 255)
+
+    return LZWDictionary(prefixes, chars)
+
+
+def check_code_width(max_code_width: int):
+    if not (MIN_CODE_WIDTH_LIMIT <= max_code_width <= MAX_CODE_WIDTH_LIMIT):
+        raise ValueError(f"Maximum code width must be in range [{MIN_CODE_WIDTH_LIMIT}, {MAX_CODE_WIDTH_LIMIT}]")
+
+
+# The dictionary never assigns the last code of a full code space, so with
+# reset enabled that code is used as CLEAR: once the dictionary is full the
+# encoder checks the compression ratio every RESET_CHECK_INTERVAL input bytes,
+# and when it falls below the best ratio seen since the last reset it flushes
+# the current phrase, emits CLEAR and both sides start from an empty dictionary.
+def lzw_compress(data: bytes, trie_class: type = FlatTrie,
+                 max_code_width: int = MAX_CODE_WIDTH, reset: bool = False, stats: dict | None = None,
+                 dictionary: LZWDictionary | None = None) -> bytes:
+    check_code_width(max_code_width)
+    max_dict_size = 2 ** max_code_width
+    clear_code = max_dict_size - 1
+
+    trie = trie_class(max_dict_size, dictionary)
     output = WriteBitStream()
 
-    index_bit_length = (trie.n_phrases - 1).bit_length()
+    bytes_in = 0
+    bits_out = 0
+    best_ratio = 0
+    next_check = RESET_CHECK_INTERVAL
+    n_resets = 0
 
     for byte in data:
         res = trie.next(byte)
-        index_bit_length = (trie.n_phrases - 2).bit_length()
 
         if not (res is None):
+            index_bit_length = (trie.n_phrases - 2).bit_length()
             # print(f"Writing index ({index_bit_length}-bit):  {res}")
-            output.write_bits(
-                int_to_bits(res, index_bit_length)
-            )
+            output.write_bits(res, index_bit_length)
+            bits_out += index_bit_length
+
+        if reset:
+            bytes_in += 1
+            if (bytes_in >= next_check) and (trie.n_phrases >= max_dict_size - 1):
+                next_check = bytes_in + RESET_CHECK_INTERVAL
+                ratio = bytes_in / bits_out if bits_out > 0 else 0
+
+                if ratio >= best_ratio:
+                    best_ratio = ratio
+                else:
+                    if trie.current_index is not None:
+                        output.write_bits(trie.current_index, max_code_width)
+                    output.write_bits(clear_code, max_code_width)
+
+                    trie = trie_class(max_dict_size, dictionary)
+                    n_resets += 1
+                    bytes_in = 0
+                    bits_out = 0
+                    best_ratio = 0
+                    next_check = RESET_CHECK_INTERVAL
 
     
-    if trie.current_node.index is not None:
-        output.write_bits(
-                int_to_bits(trie.current_node.index, index_bit_length)
-            )
+    if trie.current_index is not None:
+        output.write_bits(trie.current_index, (trie.n_phrases - 1).bit_length())
+
+    if stats is not None:
+        stats["dictionary_size"] = trie.n_phrases
+        stats["dictionary_fill"] = trie.n_phrases / max_dict_size
+        stats["resets"] = n_resets
 
     return output.get_data()
 
 
 
-def lzw_decompress(data: bytes) -> bytes:
+def lzw_decompress(data: bytes, max_code_width: int = MAX_CODE_WIDTH, reset: bool = False,
+                   dictionary: LZWDictionary | None = None) -> bytes:
+    check_code_width(max_code_width)
+    max_dict_size = 2 ** max_code_width
+    clear_code = max_dict_size - 1
+
     input = ReadBitStream(data)
-    output = WriteBitStream()
+    output = bytearray(dictionary.buffer) if dictionary is not None else bytearray()
+    preset_size = len(output)
 
-    idict = IDict()
-    index_bit_length = (len(idict.phrases) - 1).bit_length()
+    idict = OffsetIDict(max_dict_size, dictionary)
+    index_bit_length = (idict.n_phrases - 1).bit_length()
 
     while not (input.remaining_bits() < index_bit_length):
-        index = bits_to_int(input.read_bits(index_bit_length))
+        index = input.read_bits_int(index_bit_length)
         # print(f"Reading index ({index_bit_length}-bit):  {index}")
-        phrase = idict.next(index)
-        index_bit_length = (len(idict.phrases)).bit_length()
-        # print(f"Writing phrase:  {phrase}")
-        output.write_bytes(phrase)
+        if reset and (index == clear_code):
+            idict = OffsetIDict(max_dict_size, dictionary)
+            index_bit_length = (idict.n_phrases - 1).bit_length()
+            continue
+
+        idict.next(index, output)
+        index_bit_length = idict.n_phrases.bit_length()
 
     
 
-    last = input.read_all_bits()
-    if (len(last) > 0) and (bits_to_int(last) != 0):
+    if input.read_bits_int(input.remaining_bits()) != 0:
         raise RuntimeError("Unable to decode the end of the stream")
 
-    return output.get_data()
\ No newline at end of file
+    return bytes(output[preset_size:]) if preset_size > 0 else bytes(output)
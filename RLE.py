@@ -1,106 +1,501 @@
+from numpy import frombuffer, uint8, int16, int32, int64, float64, where, searchsorted, flatnonzero, concatenate, diff, array, arange, repeat, cumsum, empty, zeros, ones, argsort, unique
+from numpy import frexp, bincount, add
+
+
+MAX_PACKET_LENGTH = 127
+PACKET_STEP = [l + 1 for l in range(128)] + [1] + [2] * 127
+RLE_SPLICE_RATIO = 16
+RLE_WINDOW_SIZE = 2 ** 18
+
+
+def index_dtype(n: int):
+    return int32 if n < 2 ** 31 else int64
+
+
+def find_runs(data, min_seq_len: int):
+    a = frombuffer(data, dtype=uint8)
+    N = len(a)
+    dtype = index_dtype(N + 1)
+
+    starts = concatenate(([0], flatnonzero(a[1:] != a[:-1]).astype(dtype) + 1)).astype(dtype)
+    lengths = diff(concatenate((starts, [N])))
+    keep = lengths >= min_seq_len
+
+    return starts[keep], lengths[keep]
+
+
+def write_packets(data, kinds, starts, lengths, headers, header_lengths) -> bytes:
+    a = frombuffer(data, dtype=uint8)
+    dtype = index_dtype(2 * len(a) + 1)
+
+    # A packet is its header bytes followed by its payload: the literal bytes,
+    # or the single byte of a run.
+    header_lengths = header_lengths.astype(dtype)
+    payload_lengths = where(kinds, 1, lengths).astype(dtype)
+    packet_offsets = cumsum(header_lengths + payload_lengths) - (header_lengths + payload_lengths)
+    header_offsets = cumsum(header_lengths) - header_lengths
+    payload_offsets = cumsum(payload_lengths) - payload_lengths
+
+    n_headers = int(header_lengths.sum())
+    n_payload = int(payload_lengths.sum())
+    encoded_data = empty(n_headers + n_payload, dtype=uint8)
+
+    k = arange(n_headers, dtype=dtype) - repeat(header_offsets, header_lengths)
+    encoded_data[repeat(packet_offsets, header_lengths) + k] = headers
+
+    k = arange(n_payload, dtype=dtype) - repeat(payload_offsets, payload_lengths)
+    encoded_data[repeat(packet_offsets + header_lengths, payload_lengths) + k] = a[repeat(starts.astype(dtype), payload_lengths) + k]
+
+    return encoded_data.tobytes()
+
+
+# The encoders work on windows of about RLE_WINDOW_SIZE bytes, so their index
+# arrays stay bounded whatever the input size. Packets never span two windows
+# and both formats are plain sequences of packets, so the windows' outputs are
+# simply concatenated. A window is extended to the end of the run it would cut.
+def window_end(a, start: int) -> int:
+    N = len(a)
+    end = start + RLE_WINDOW_SIZE
+    while end < N and a[end] == a[end - 1]:
+        changes = flatnonzero(a[end:end+RLE_WINDOW_SIZE] != a[end - 1])
+        if len(changes) > 0:
+            return end + int(changes[0])
+        end += RLE_WINDOW_SIZE
+
+    return min(end, N)
+
+
+def encode_windows(data, encode_window, stats: dict | None = None, **kwargs) -> bytes:
+    a = frombuffer(data, dtype=uint8)
+
+    encoded_data = bytearray()
+    if stats is not None:
+        kwargs["stats"] = window_stats = {}
+        stats.update(runs=0, literals=0, run_lengths={})
+
+    start = 0
+    while start < len(a):
+        end = window_end(a, start)
+        encoded_data += encode_window(a[start:end], **kwargs)
+        start = end
+
+        if stats is not None:
+            stats["runs"] += window_stats["runs"]
+            stats["literals"] += window_stats["literals"]
+            for length, count in window_stats["run_lengths"].items():
+                stats["run_lengths"][length] = stats["run_lengths"].get(length, 0) + count
+
+    return bytes(encoded_data)
+
+
+def expand_runs(payload, positions, run_lengths) -> bytes:
+    # The payload bytes at positions are repeated run_lengths times and every
+    # other byte is output once, one window of payload at a time.
+    decoded_data = bytearray()
+
+    for w in range(0, len(payload), RLE_WINDOW_SIZE):
+        window = payload[w:w+RLE_WINDOW_SIZE]
+        lo, hi = searchsorted(positions, [w, w + RLE_WINDOW_SIZE])
+
+        counts = ones(len(window), dtype=int64)
+        counts[positions[lo:hi] - w] = run_lengths[lo:hi]
+        decoded_data += repeat(window, counts).tobytes()
+
+    return bytes(decoded_data)
+
+
+def run_length_stats(kinds, lengths, stats: dict):
+    values, counts = unique(lengths[kinds], return_counts=True)
+
+    stats["runs"] = int(kinds.sum())
+    stats["literals"] = len(kinds) - stats["runs"]
+    stats["run_lengths"] = dict(zip(values.tolist(), counts.tolist()))
 
 
 def RLE_encode(data: bytes,
-               min_seq_len_to_compress: int = 3) -> bytes:
+               min_seq_len_to_compress: int = 3, stats: dict | None = None) -> bytes:
     
     N = len(data)
     if N == 0:
         raise RuntimeError("Cannot encode empty data")
 
-    encoded_data = bytearray()
+    if not (1 <= min_seq_len_to_compress <= MAX_PACKET_LENGTH):
+        raise ValueError(f"Minimal sequence length must be in range [1, {MAX_PACKET_LENGTH}]")
+
+    return encode_windows(data, _RLE_encode_window, stats, min_seq_len_to_compress=min_seq_len_to_compress)
+
+
+def _RLE_encode_window(data, min_seq_len_to_compress: int, stats: dict | None = None) -> bytes:
+    N = len(data)
+    m = min_seq_len_to_compress
+    P = MAX_PACKET_LENGTH
+
+    kinds = []
+    starts = []
+    lengths = []
 
     def write_same_byte(beg: int, end: int):
         if end - beg <= 0:
             return
 
-        L = 128 + (end - beg)
-        b = data[beg]
-
-        encoded_data.append(L)
-        encoded_data.append(b)
+        kinds.append(True)
+        starts.append(beg)
+        lengths.append(end - beg)
 
     def write_different_bytes(beg: int, end: int):
-        if end - beg <= 0:
-            return
-        
-        L = end - beg
-        b = data[beg:end]
+        for k in range(beg, end, P):
+            kinds.append(False)
+            starts.append(k)
+            lengths.append(min(P, end - k))
 
-        encoded_data.append(L)
-        encoded_data.extend(b)
+    # Packets are cut where a byte-by-byte scan would cut them: a pending
+    # literal is flushed every 127 bytes, and a run of at least min_seq_len
+    # bytes (counted from the start of the pending literal) is flushed when it
+    # ends or reaches 127 bytes. Only runs long enough to be flushed matter;
+    # everything between them is literal material.
+    def write_run(i: int, r: int, e: int) -> int:
+        n_full = (r - i) // P
+        write_different_bytes(i, i + n_full * P)
+        i += n_full * P
 
+        j = min(i + P, e)
+        if j - r >= m:
+            write_different_bytes(i, r)
+            write_same_byte(r, j)
+        else:
+            write_different_bytes(i, j)
+        i = j
 
-    consecutive_count = 1
-    i = 0
-    prev_byte = data[0]
-    for j in range(1, N):
+        while e - i >= m:
+            j = min(i + P, e)
+            write_same_byte(i, j)
+            i = j
 
-        if consecutive_count == 127:
-            write = True
+        return i
 
-        elif j - i == 127:
-            write = True
+    r, L = find_runs(data, m)
+    e = r + L
+    prev_e = concatenate(([0], e[:-1]))
 
-        elif data[j] == prev_byte:
-            write = False
-            consecutive_count += 1
+    # When the pending literal starts right after the previous run, a run with
+    # less than 127 bytes from there to its end becomes exactly one literal
+    # packet (possibly empty) and one run packet, and leaves nothing pending.
+    # Those runs are emitted in bulk; the rest go through write_run, together
+    # with any runs following one that left a few bytes pending.
+    simple = (e - prev_e <= P)
+    i = 0
+    k = 0
+    for c in flatnonzero(~simple).tolist():
+        if c < k:
+            continue
 
-        elif (data[j] != prev_byte):
-            if consecutive_count >= min_seq_len_to_compress:
-                write = True
-            else:
-                write = False
-                consecutive_count = 1
+        k = c
+        i = write_run(int(prev_e[k]), int(r[k]), int(e[k]))
+        simple[k] = False
+        while (i != e[k]) and (k + 1 < len(r)):
+            k += 1
+            i = write_run(i, int(r[k]), int(e[k]))
+            simple[k] = False
+        k += 1
 
+    if len(r) > 0 and simple[-1]:
+        i = int(e[-1])
+    elif len(r) == 0:
+        i = 0
+    write_different_bytes(i, N)
 
-        if write is True:
-            c = (consecutive_count >= min_seq_len_to_compress) * consecutive_count
-            write_different_bytes(i, j-c)
-            write_same_byte(j-c, j)
+    literal = simple & (r > prev_e)
+    kinds = concatenate((array(kinds, dtype=bool), zeros(int(literal.sum()), dtype=bool), ones(int(simple.sum()), dtype=bool)))
+    starts = concatenate((array(starts, dtype=int64), prev_e[literal], r[simple]))
+    lengths = concatenate((array(lengths, dtype=int64), (r - prev_e)[literal], L[simple]))
 
-            consecutive_count = 1
-            i = j
-        
-        prev_byte = data[j]
+    order = argsort(starts, kind='stable')
 
-    c = (consecutive_count >= min_seq_len_to_compress) * consecutive_count
-    write_different_bytes(i, N-c)
-    write_same_byte(N-c, N)
+    if stats is not None:
+        run_length_stats(kinds, lengths, stats)
 
-    return bytes(encoded_data)
+    kinds, lengths = kinds[order], lengths[order]
+    headers = (lengths + 128 * kinds).astype(uint8)
+
+    return write_packets(data, kinds, starts[order], lengths, headers, ones(len(lengths), dtype=int64))
 
 
 
 def RLE_decode(data: bytes) -> bytes:
     N = len(data)
-    decoded_data = bytearray()
+
+    heads = []
 
     i = 0
     while i < N:
-        l = data[i]
-        if l > 128:
-            different = False
-            l -= 128
-        elif l < 128:
-            different = True
-        else:
-            raise RuntimeError("Zero byte corresponding to sequence length")
-        
-        i += 1
-        
-        if different:
-            if i + l - 1 >= N:
-                raise RuntimeError("Byte sequence length exceeds file length")
-            
-            decoded_data.extend(data[i:i+l])
-            i += l
-        
-        else:
-            if i >= N:
+        heads.append(i)
+        i += PACKET_STEP[data[i]]
+
+    if not heads:
+        return bytes()
+
+    a = frombuffer(data, dtype=uint8)
+    heads = array(heads, dtype=int64)
+    headers = a[heads].astype(int64)
+
+    if (headers == 128).any():
+        raise RuntimeError("Zero byte corresponding to sequence length")
+    if i > N:
+        raise RuntimeError("Byte sequence length exceeds file length")
+
+    # Without the headers the packets are just their payload bytes; each literal
+    # payload byte is output once and each run payload byte is repeated.
+    payload_mask = ones(N, dtype=bool)
+    payload_mask[heads] = False
+    payload = a[payload_mask]
+
+    runs = flatnonzero(headers > 128)
+    if len(runs) == 0:
+        return payload.tobytes()
+
+    positions = heads[runs] - runs
+    run_lengths = headers[runs] - 128
+
+    # With few runs, repeating every payload byte once costs more than
+    # splicing the runs into slice copies of the literal stretches.
+    if len(runs) * RLE_SPLICE_RATIO < len(payload):
+        payload = payload.tobytes()
+        decoded_data = bytearray()
+
+        prev = 0
+        for p, l in zip(positions.tolist(), run_lengths.tolist()):
+            decoded_data += payload[prev:p]
+            decoded_data += payload[p:p+1] * l
+            prev = p + 1
+        decoded_data += payload[prev:]
+
+        return bytes(decoded_data)
+
+    return expand_runs(payload, positions, run_lengths)
+
+
+
+# Extended format: every packet starts with a LEB128 varint header
+# (length << 1) | is_run, followed by the literal bytes or the single run byte,
+# so neither runs nor literals are capped at 127 bytes.
+def write_varints(values):
+    n_bytes = ones(len(values), dtype=int64)
+    for k in range(1, 10):
+        n_bytes += values >= (1 << (7 * k))
+
+    offsets = cumsum(n_bytes) - n_bytes
+    encoded = empty(int(n_bytes.sum()), dtype=uint8)
+
+    for k in range(int(n_bytes.max(initial=0))):
+        idx = flatnonzero(n_bytes > k)
+        more = (n_bytes[idx] > k + 1) * 128
+        encoded[offsets[idx] + k] = ((values[idx] >> (7 * k)) & 127) | more
+
+    return encoded, n_bytes
+
+
+def extended_RLE_encode(data: bytes,
+                        min_seq_len_to_compress: int = 3, stats: dict | None = None) -> bytes:
+    N = len(data)
+    if N == 0:
+        return bytes()
+
+    if min_seq_len_to_compress < 1:
+        raise ValueError("Minimal sequence length must be positive")
+
+    return encode_windows(data, _extended_RLE_encode_window, stats, min_seq_len_to_compress=min_seq_len_to_compress)
+
+
+def _extended_RLE_encode_window(data, min_seq_len_to_compress: int, stats: dict | None = None) -> bytes:
+    N = len(data)
+
+    r, L = find_runs(data, min_seq_len_to_compress)
+    e = r + L
+    prev_e = concatenate(([0], e[:-1]))
+
+    literal = r > prev_e
+    kinds = concatenate((zeros(int(literal.sum()), dtype=bool), ones(len(r), dtype=bool)))
+    starts = concatenate((prev_e[literal], r))
+    lengths = concatenate(((r - prev_e)[literal], L)).astype(int64)
+
+    last = int(e[-1]) if len(e) > 0 else 0
+    if last < N:
+        kinds = concatenate((kinds, [False]))
+        starts = concatenate((starts, [last]))
+        lengths = concatenate((lengths, [N - last]))
+
+    order = argsort(starts, kind='stable')
+    kinds, starts, lengths = kinds[order], starts[order], lengths[order]
+
+    if stats is not None:
+        run_length_stats(kinds, lengths, stats)
+
+    headers, header_lengths = write_varints((lengths << 1) | kinds)
+
+    return write_packets(data, kinds, starts, lengths, headers, header_lengths)
+
+
+def extended_RLE_decode(data: bytes) -> bytes:
+    N = len(data)
+
+    heads = []
+    header_lengths = []
+    headers = []
+
+    i = 0
+    while i < N:
+        h = 0
+        shift = 0
+        j = i
+        while True:
+            if j >= N:
                 raise RuntimeError("Byte sequence length exceeds file length")
-            
-            decoded_data.extend(int.to_bytes(data[i]) * l)
-            i += 1
+            b = data[j]
+            h |= (b & 127) << shift
+            shift += 7
+            j += 1
+            if b < 128:
+                break
+
+        if (h >> 1) == 0:
+            raise RuntimeError("Zero byte corresponding to sequence length")
+
+        heads.append(i)
+        header_lengths.append(j - i)
+        headers.append(h)
+        i = j + (1 if h & 1 else h >> 1)
+
+    if i > N:
+        raise RuntimeError("Byte sequence length exceeds file length")
+
+    if not heads:
+        return bytes()
+
+    a = frombuffer(data, dtype=uint8)
+    heads = array(heads, dtype=int64)
+    header_lengths = array(header_lengths, dtype=int64)
+    headers = array(headers, dtype=int64)
+
+    header_offsets = cumsum(header_lengths) - header_lengths
+    payload_mask = ones(N, dtype=bool)
+    payload_mask[repeat(heads, header_lengths) + arange(int(header_lengths.sum())) - repeat(header_offsets, header_lengths)] = False
+    payload = a[payload_mask]
+
+    kinds = (headers & 1).astype(bool)
+    runs = flatnonzero(kinds)
+    if len(runs) == 0:
+        return payload.tobytes()
+
+    # Payload index of a run byte: its position minus all header bytes before it.
+    positions = (heads + header_lengths)[runs] - (header_offsets + header_lengths)[runs]
+
+    return expand_runs(payload, positions, headers[runs] >> 1)
+
+
+# Zero-run format (bzip2's RUNA/RUNB), meant for MTF output, where zeros
+# dominate. A run of n zeros becomes the bijective base-2 digits of n, least
+# significant first, as RUNA (0, worth 1) and RUNB (1, worth 2): these are the
+# bits of n + 1 below its leading one. A nonzero byte v is stored as v + 1 up
+# to 253, and 254 and 255 as ZRLE_ESCAPE followed by 0 or 1. An escape is
+# never followed by another escape, so every 255 in the output is one.
+RUNA = 0
+RUNB = 1
+ZRLE_ESCAPE = 255
+
+
+# Both directions work one window of about RLE_WINDOW_SIZE bytes at a time.
+# Encoding windows never cut a zero run, and decoding windows never cut a digit
+# group or an escape sequence, so every window is coded on its own.
+def zero_run_encode(data: bytes) -> bytes:
+    return encode_windows(data, _zero_run_encode_window)
+
+
+def _zero_run_encode_window(data) -> bytes:
+    a = frombuffer(data, dtype=uint8)
+    N = len(a)
+    dtype = index_dtype(2 * N + 1)
+
+    r, L = find_runs(data, 1)
+    zero = a[r] == 0
+    r, L = r[zero], L[zero]
+
+    # Output bytes taken by every input byte: a run start takes one byte per
+    # digit, the rest of a run none, escaped bytes two and the others one.
+    n_digits = frexp((L + 1).astype(float64))[1] - 1
+    out_lengths = ones(N, dtype=dtype) + (a >= 254)
+    out_lengths[a == 0] = 0
+    out_lengths[r] = n_digits
+    offsets = cumsum(out_lengths) - out_lengths
+
+    encoded_data = empty(int(out_lengths.sum()), dtype=uint8)
+
+    literal = flatnonzero((a > 0) & (a < 254))
+    encoded_data[offsets[literal]] = a[literal] + 1
+
+    escaped = flatnonzero(a >= 254)
+    encoded_data[offsets[escaped]] = ZRLE_ESCAPE
+    encoded_data[offsets[escaped] + 1] = a[escaped] - 254
+
+    run_of_digit = repeat(arange(len(r), dtype=dtype), n_digits)
+    digit_offsets = cumsum(n_digits) - n_digits
+    k = arange(int(n_digits.sum()), dtype=dtype) - digit_offsets[run_of_digit]
+    encoded_data[offsets[r][run_of_digit] + k] = ((L[run_of_digit] + 1) >> k) & 1
+
+    return encoded_data.tobytes()
+
+
+def zero_run_decode(data: bytes) -> bytes:
+    b = frombuffer(data, dtype=uint8)
+    N = len(b)
+
+    decoded_data = bytearray()
+    start = 0
+    while start < N:
+        # A window may not end on an escape or between two digits of a group;
+        # a byte after an escape is its payload, not a digit.
+        end = min(start + RLE_WINDOW_SIZE, N)
+        while end < N and (b[end - 1] == ZRLE_ESCAPE or
+                           (b[end - 1] <= RUNB and b[end] <= RUNB and (end - 1 == start or b[end - 2] != ZRLE_ESCAPE))):
+            end += 1
+            if end - start > RLE_WINDOW_SIZE + 64:
+                raise ValueError("Zero run is too long")
+
+        decoded_data += _zero_run_decode_window(b[start:end])
+        start = end
+
+    return bytes(decoded_data)
+
+
+def _zero_run_decode_window(b) -> bytes:
+    N = len(b)
+
+    escaped = flatnonzero(b == ZRLE_ESCAPE)
+    if len(escaped) > 0 and (escaped[-1] == N - 1 or (b[escaped + 1] > 1).any()):
+        raise ValueError("Incorrect zero-run escape sequence")
+
+    payload = zeros(N, dtype=bool)
+    payload[escaped + 1] = True
+
+    values = b.astype(int16) - 1
+    values[escaped] = 254 + b[escaped + 1]
+
+    # A token is a literal, an escape or the first digit of a run; each digit
+    # group adds up to the run length it encodes.
+    digit = (b <= RUNB) & ~payload
+    group_start = digit & ~concatenate(([False], digit[:-1]))
+    digit_starts = flatnonzero(group_start)
+    counts = (~digit & ~payload).astype(int64)
+
+    if len(digit_starts) > 0:
+        digits = flatnonzero(digit)
+        group = cumsum(group_start)[digits] - 1
+        n_digits = bincount(group)
+        if n_digits.max() >= 63:
+            raise ValueError("Zero run is too long")
 
+        first = cumsum(n_digits) - n_digits
+        k = arange(len(digits)) - first[group]
+        counts[digit_starts] = add.reduceat(b[digits].astype(int64) << k, first) + (1 << n_digits) - 1
+        values[digit_starts] = 0
 
-    return bytes(decoded_data)
\ No newline at end of file
+    return repeat(values.astype(uint8), counts).tobytes()
@@ -10,6 +10,14 @@ from tkinter import filedialog, ttk
 
 
 # ------------------ Callbacks ------------------
+def stage_options():
+    # Auto picks its own pipeline and records it in the stream
+    if algorithm.get() == "Auto":
+        return {}
+
+    return {"bwt": bwt_flag.get(), "mtf": mtf_flag.get()}
+
+
 def select_file():
     path = filedialog.askopenfilename(
         title="Select a file",
@@ -39,8 +47,7 @@ def on_decode():
         decoded_data = decompress(
             data,
             alg=algorithm.get(),
-            bwt=bwt_flag.get(),
-            mtf=mtf_flag.get()
+            **stage_options()
         )
     
     except RuntimeError as e:
@@ -88,8 +95,7 @@ def on_encode():
         encoded_data = compress(
             data,
             alg=algorithm.get(),
-            bwt=bwt_flag.get(),
-            mtf=mtf_flag.get()
+            **stage_options()
         )
     
     except RuntimeError as e:
@@ -144,7 +150,7 @@ filepath.pack()
 # ===== SELECT ALGORITHM =====
 ttk.Label(root, text="Select Algorithm:", background="#ffffff").pack(pady=(25, 7))
 algorithm = ttk.Combobox(root, width=30, state="readonly")
-algorithm['values'] = ("RLE", "Huffman", "LZW")
+algorithm['values'] = ("RLE", "Huffman", "LZW", "Auto")
 algorithm.current(0)
 algorithm.pack()
 # ===== SELECT ALGORITHM =====
@@ -1,16 +1,227 @@
 from typing import Literal
-from helpers import MTF, inverse_MTF, BWT, inverse_BWT
-from RLE import RLE_encode, RLE_decode
-from Huffman import huffman_encode, huffman_decode
-from LZW import lzw_compress, lzw_decompress
+from helpers import MTF, inverse_MTF, BWT, inverse_BWT, inverse_BWT_blocks
+from RLE import RLE_encode, RLE_decode, extended_RLE_encode, extended_RLE_decode, zero_run_encode, zero_run_decode
+from Huffman import huffman_encode, huffman_decode, canonical_huffman_encode, canonical_huffman_decode
+from Huffman import static_huffman_encode, static_huffman_decode, multi_table_huffman_encode, multi_table_huffman_decode
+from Huffman import registered_huffman_tables, register_huffman_tables
+from LZW import lzw_compress, lzw_decompress, MAX_CODE_WIDTH as LZW_MAX_CODE_WIDTH
 from numpy import ceil
 from copy import deepcopy
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import io
+import os
+import mmap
+import zlib
+import tracemalloc
+from time import perf_counter
+from numpy import frombuffer, uint8, bincount, log2
 
 
 BWT_BLOCK_SIZE = 1024
+BWT_MAX_BLOCK_SIZE = 2 ** 24
+BWT_HEADER_SIZE_BYTES = 4
+BWT_LENGTH_SIZE_BYTES = 8
 MTF_ALPH = [i for i in range(256)]
 
-def compress(data: bytes, alg: Literal["RLE", "Huffman", "LZW"], **options) -> bytes:
+# Every stream starts with b'STAGES_' and a flags byte naming the BWT, MTF and
+# zero-run stages it went through (0 for none), followed by the entropy-coded
+# stream. The stages of such a stream are never detected from the decoded
+# data, so any input survives the round trip, whatever bytes it starts with.
+# Streams without the prefix were written by the original format, whose
+# MTF_/BWT_ tags inside the decoded data are still recognised.
+STAGE_BWT = 1
+STAGE_MTF = 2
+STAGE_ZRLE = 4
+STAGE_NAMES = (("zrle", STAGE_ZRLE, "zero-run coding", "ZRLE"), ("mtf", STAGE_MTF, "MTF", "MTF"),
+               ("bwt", STAGE_BWT, "BWT", "BWT"))
+
+
+# Passing stats=<callable> to compress()/decompress() calls it once per stage
+# with a record: stage, direction, seconds, bytes_in, bytes_out, peak_memory
+# (bytes allocated on top of what was live when the stage started) and, for
+# the entropy coders, codec counters. Without stats every stage is a plain
+# call. Framed formats report one "framing" record after the records of their
+# blocks; with workers > 1 the blocks run in other processes and only the
+# framing record is reported.
+class PipelineStats:
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.records = []
+
+    def __call__(self, record: dict):
+        self.records.append(record)
+
+    def totals(self) -> dict:
+        totals = {}
+        for record in self.records:
+            key = (record["direction"], record["stage"])
+            total = totals.setdefault(key, {"seconds": 0.0, "bytes_in": 0, "bytes_out": 0, "peak_memory": 0})
+            total["seconds"] += record["seconds"]
+            total["bytes_in"] += record["bytes_in"]
+            total["bytes_out"] += record["bytes_out"]
+            total["peak_memory"] = max(total["peak_memory"], record["peak_memory"] or 0)
+
+        return totals
+
+
+# tracemalloc keeps a single peak, so a stage nested in another (a block inside
+# framing) resets it; the peak seen so far is handed to the enclosing stage here.
+_STAGE_PEAKS = []
+
+
+def run_stage(report, direction: str, stage: str, func, data, *args, counters: bool = False, **kwargs):
+    if report is None:
+        return func(data, *args, **kwargs)
+
+    record = {"stage": stage, "direction": direction, "bytes_in": len(data)}
+    if counters:
+        record["counters"] = kwargs["stats"] = {}
+
+    trace_memory = getattr(report, "trace_memory", True)
+    if trace_memory:
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        base, outer_peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        _STAGE_PEAKS.append(0)
+
+    start = perf_counter()
+    try:
+        result = func(data, *args, **kwargs)
+    finally:
+        record["seconds"] = perf_counter() - start
+
+        record["peak_memory"] = None
+        if trace_memory:
+            peak = max(tracemalloc.get_traced_memory()[1], _STAGE_PEAKS.pop())
+            record["peak_memory"] = peak - base
+            if started:
+                tracemalloc.stop()
+            elif _STAGE_PEAKS:
+                _STAGE_PEAKS[-1] = max(_STAGE_PEAKS[-1], outer_peak, peak)
+
+    record["bytes_out"] = len(result) if not isinstance(result, int) else result
+    report(record)
+
+    return result
+
+
+def bwt_index_size(block_size: int) -> int:
+    return int(ceil(block_size.bit_length() / 8))
+
+
+def bwt_encode_blocks(data: bytes, block_size: int = BWT_BLOCK_SIZE) -> bytearray:
+    if not isinstance(block_size, int) or not (1 <= block_size <= BWT_MAX_BLOCK_SIZE):
+        raise ValueError(f"BWT block size must be an integer in range [1, {BWT_MAX_BLOCK_SIZE}]")
+
+    new_data = bytearray(block_size.to_bytes(BWT_HEADER_SIZE_BYTES, byteorder='big'))
+    new_data.extend(len(data).to_bytes(BWT_LENGTH_SIZE_BYTES, byteorder='big'))
+
+    for i in range(0, len(data), block_size):
+        new_data.extend(BWT(data[i:i+block_size]))
+
+    return new_data
+
+
+def bwt_decode_blocks(data: bytes) -> bytearray:
+    if len(data) < BWT_HEADER_SIZE_BYTES + BWT_LENGTH_SIZE_BYTES:
+        raise ValueError("Incorrect BWT header format")
+
+    i = 0
+    block_size = int.from_bytes(data[i:i+BWT_HEADER_SIZE_BYTES], byteorder='big')
+    i += BWT_HEADER_SIZE_BYTES
+    N = int.from_bytes(data[i:i+BWT_LENGTH_SIZE_BYTES], byteorder='big')
+    i += BWT_LENGTH_SIZE_BYTES
+
+    if not (1 <= block_size <= BWT_MAX_BLOCK_SIZE):
+        raise ValueError("Invalid BWT block size in header")
+
+    n_full, last_size = divmod(N, block_size)
+    idx_size = bwt_index_size(block_size)
+    last_idx_size = bwt_index_size(last_size) if last_size > 0 else 0
+
+    full_end = i + n_full * (block_size + idx_size)
+    if full_end + last_size + last_idx_size != len(data):
+        raise ValueError("Data length does not match BWT header")
+
+    new_data = bytearray(inverse_BWT_blocks(data[i:full_end], block_size, idx_size))
+    if last_size > 0:
+        new_data.extend(inverse_BWT(data[full_end:], last_idx_size))
+
+    return new_data
+
+
+AUTO_SAMPLE_SIZE = 2 ** 16
+AUTO_N_SAMPLES = 3
+AUTO_TIME_BUDGET = 0.5
+AUTO_CANDIDATES = [
+    ("RLE", {"extended": True}),
+    ("Huffman", {"canonical": True}),
+    ("Huffman", {"canonical": True, "bwt": True, "mtf": True, "bwt_block_size": 2 ** 16}),
+    ("LZW", {"lzw_max_code_width": 16, "lzw_reset": True}),
+    ("RLE", {"extended": True, "bwt": True, "mtf": True, "bwt_block_size": 2 ** 16}),
+]
+# Options that pick a pipeline. With alg="auto" the caller's values are
+# dropped, so only a pipeline that was trial-compressed is ever written.
+PIPELINE_OPTIONS = ("bwt", "bwt_block_size", "mtf", "zrle", "extended", "canonical", "max_code_length",
+                    "multi_table", "n_tables", "huffman_table", "lzw_max_code_width", "lzw_reset")
+
+
+def sample_blocks(data, sample_size: int = AUTO_SAMPLE_SIZE, n_samples: int = AUTO_N_SAMPLES) -> list:
+    N = len(data)
+    if N <= sample_size * n_samples:
+        return [data]
+
+    step = (N - sample_size) // (n_samples - 1) if n_samples > 1 else 0
+    return [data[k * step:k * step + sample_size] for k in range(n_samples)]
+
+
+def byte_statistics(data) -> tuple:
+    a = frombuffer(data, dtype=uint8)
+    if len(a) == 0:
+        return 0.0, 0.0
+
+    p = bincount(a, minlength=256) / len(a)
+    p = p[p > 0]
+    entropy = float(-(p * log2(p)).sum())
+    repeats = float((a[1:] == a[:-1]).mean()) if len(a) > 1 else 0.0
+
+    return entropy, repeats
+
+
+# alg="auto" trial-compresses a few evenly spaced samples with every candidate
+# pipeline, cheapest first, until time_budget seconds are spent, and keeps the
+# one with the smallest output. Samples that look incompressible (near 8 bits
+# of order-0 entropy and hardly any repeats) skip the trials. Each compressed
+# stream is tagged with the pipeline used, so decompress() needs no options;
+# with workers or container the choice is made per block. Pipeline options
+# given by the caller (bwt, mtf, lzw_dictionary, ...) are ignored.
+def select_pipeline(data, time_budget: float = AUTO_TIME_BUDGET) -> tuple:
+    samples = sample_blocks(data)
+
+    entropy, repeats = byte_statistics(samples[0] if len(samples) == 1 else b''.join(bytes(s) for s in samples))
+    if len(data) == 0 or (entropy > 7.9 and repeats < 0.01):
+        return AUTO_CANDIDATES[0][0], dict(AUTO_CANDIDATES[0][1])
+
+    best = None
+    deadline = perf_counter() + time_budget
+    for alg, options in AUTO_CANDIDATES:
+        size = sum(len(compress(sample, alg, **options)) for sample in samples)
+
+        if best is None or size < best[0]:
+            best = (size, alg, options)
+
+        if perf_counter() > deadline:
+            break
+
+    return best[1], dict(best[2])
+
+
+def compress(data: bytes, alg: Literal["RLE", "Huffman", "LZW", "auto"], **options) -> bytes:
+    stats = options.pop("stats", None)
+    dictionary = options.pop("lzw_dictionary", None)
     _options = deepcopy(options)
     for key in list(_options.keys()):
         if isinstance(_options[key], str):
@@ -19,52 +230,97 @@ def compress(data: bytes, alg: Literal["RLE", "Huffman", "LZW"], **options) -> b
         if isinstance(key, str):
             key_lower = key.lower()
             _options[key_lower] = _options.pop(key)
+
+    workers = _options.get("workers", 1)
+    block_options = {"stats": stats if workers is None or workers <= 1 else None}
+    if dictionary is not None:
+        block_options["lzw_dictionary"] = dictionary
+
+    if "container" in _options and _options["container"]:
+        _options.pop("container")
+        return run_stage(stats, "compress", "framing", compress_container, data, alg, **block_options, **_options)
+
+    if "workers" in _options:
+        workers = _options.pop("workers")
+        chunk_size = _options.pop("chunk_size", STREAM_CHUNK_SIZE)
+
+        dst = io.BytesIO()
+        dst.write(b'STREAM_')
+        run_stage(stats, "compress", "framing",
+                  lambda view: write_frames(view_chunks(view, chunk_size), dst, alg, workers, **block_options, **_options), data)
+        return dst.getvalue()
             
-    if not ("bwt" in _options) and not ("mtf" in _options):
-        _data = data
-    else:
-        _data = bytearray(data)
+    # Every stage reads its input through the buffer protocol, so bytes,
+    # bytearray, memoryview and mmap inputs are all used without a copy.
+    _data = data if isinstance(data, (bytes, bytearray)) else memoryview(data).cast('B')
 
+    if isinstance(alg, str) and alg.lower() == "auto":
+        time_budget = _options.pop("auto_time_budget", AUTO_TIME_BUDGET)
+        alg, chosen_options = select_pipeline(_data, time_budget)
+        for key in PIPELINE_OPTIONS:
+            _options.pop(key, None)
+        _options.update(chosen_options)
+        dictionary = None
+
+    stages = 0
     if "bwt" in _options and _options["bwt"]:
-        new_data = bytearray(b'BWT_')
-
-        if len(_data) % BWT_BLOCK_SIZE != 0:
-            padding_size = BWT_BLOCK_SIZE - (len(_data) % BWT_BLOCK_SIZE)
-            new_data.extend(
-                padding_size.to_bytes(int(ceil(BWT_BLOCK_SIZE.bit_length() / 8)), byteorder='big')
-            )
-            new_data.extend(b'_')
-            _data.extend(b'\x00' * padding_size)
-
-        for i in range(0, len(_data), BWT_BLOCK_SIZE):
-            new_data.extend(BWT(_data[i:i+BWT_BLOCK_SIZE]))
-        
-        _data = new_data
+        stages |= STAGE_BWT
+        _data = run_stage(stats, "compress", "bwt", bwt_encode_blocks, _data, _options.get("bwt_block_size", BWT_BLOCK_SIZE))
 
     if "mtf" in _options and _options["mtf"]:
-        _data = MTF(_data, MTF_ALPH)
-        
-        _data = bytearray(b'MTF_') + _data
+        stages |= STAGE_MTF
+        _data = run_stage(stats, "compress", "mtf", MTF, _data, MTF_ALPH)
 
-    _data = bytes(_data)
+    if "zrle" in _options and _options["zrle"]:
+        stages |= STAGE_ZRLE
+        _data = run_stage(stats, "compress", "zrle", zero_run_encode, _data)
+
+    prefix = b'STAGES_' + bytes([stages])
 
     _alg = alg
     if isinstance(alg, str):
         _alg = alg.lower()
 
     if _alg == "rle":
-        return bytes(b'RLE_') + RLE_encode(_data)
+        if "extended" in _options and _options["extended"]:
+            return prefix + b'XRLE_' + run_stage(stats, "compress", "rle", extended_RLE_encode, _data, counters=True)
+        return prefix + b'RLE_' + run_stage(stats, "compress", "rle", RLE_encode, _data, counters=True)
     elif _alg == "huffman":
-        return bytes(b'HUFFMAN_') + huffman_encode(_data)
+        if ("multi_table" in _options and _options["multi_table"]) or _options.get("n_tables") is not None:
+            return prefix + b'MHUFFMAN_' + run_stage(stats, "compress", "huffman", multi_table_huffman_encode, _data,
+                                                   _options.get("n_tables"), counters=True)
+        if _options.get("huffman_table") is not None:
+            return prefix + b'SHUFFMAN_' + run_stage(stats, "compress", "huffman", static_huffman_encode, _data,
+                                                   int(_options["huffman_table"]), counters=True)
+        if ("canonical" in _options and _options["canonical"]) or _options.get("max_code_length") is not None:
+            return prefix + b'CHUFFMAN_' + run_stage(stats, "compress", "huffman", canonical_huffman_encode, _data,
+                                                   _options.get("max_code_length"), counters=True)
+        return prefix + b'HUFFMAN_' + run_stage(stats, "compress", "huffman", huffman_encode, _data, counters=True)
     elif _alg == "lzw":
-        return bytes(b'LZW_') + lzw_compress(_data)
+        if dictionary is not None:
+            max_code_width = _options.get("lzw_max_code_width", LZW_MAX_CODE_WIDTH)
+            reset = bool(_options.get("lzw_reset", False))
+
+            encoded = run_stage(stats, "compress", "lzw", lzw_compress, _data,
+                                max_code_width=max_code_width, reset=reset, dictionary=dictionary, counters=True)
+            return prefix + b'LZWD_' + bytes([max_code_width, reset]) + dictionary.crc.to_bytes(4, byteorder='big') + encoded
+        if ("lzw_max_code_width" in _options) or ("lzw_reset" in _options):
+            max_code_width = _options.get("lzw_max_code_width", LZW_MAX_CODE_WIDTH)
+            reset = bool(_options.get("lzw_reset", False))
+
+            encoded = run_stage(stats, "compress", "lzw", lzw_compress, _data,
+                                max_code_width=max_code_width, reset=reset, counters=True)
+            return prefix + b'LZWA_' + bytes([max_code_width, reset]) + encoded
+        return prefix + b'LZW_' + run_stage(stats, "compress", "lzw", lzw_compress, _data, counters=True)
     else:
         raise ValueError("Unknown compression algorithm")
     
 
 
 
-def decompress(data: bytes, alg: Literal["RLE", "Huffman", "LZW"] | None = None, **options) -> bytes:
+def decompress(data: bytes, alg: Literal["RLE", "Huffman", "LZW", "auto"] | None = None, **options) -> bytes:
+    stats = options.pop("stats", None)
+    dictionary = options.pop("lzw_dictionary", None)
     _options = deepcopy(options)
     for key in list(_options.keys()):
         if isinstance(_options[key], str):
@@ -77,50 +333,143 @@ def decompress(data: bytes, alg: Literal["RLE", "Huffman", "LZW"] | None = None,
     _alg = alg
     if isinstance(alg, str):
         _alg = alg.lower()
+    if _alg == "auto":
+        _alg = None
+
+    head = bytes(data[:16])
+
+    workers = _options.get("workers", 1)
+    block_options = {"stats": stats if workers is None or workers <= 1 else None, "lzw_dictionary": dictionary}
+
+    if head.startswith(CONTAINER_MAGIC):
+        return run_stage(stats, "decompress", "framing", decompress_container, data, workers, **block_options)
 
-    if (_alg == "rle") or data.startswith(b'RLE_'):
-        if not data.startswith(b'RLE_'):
+    if head.startswith(b'STREAM_'):
+        dst = io.BytesIO()
+        run_stage(stats, "decompress", "framing",
+                  lambda view: decompress_stream(io.BytesIO(view), dst, workers, **block_options), data)
+        return dst.getvalue()
+
+    stages = None
+    if head.startswith(b'STAGES_'):
+        if len(data) < 8:
+            raise ValueError("Incorrect STAGES_ header format")
+
+        stages = data[7]
+        if stages & ~(STAGE_BWT | STAGE_MTF | STAGE_ZRLE):
+            raise ValueError("Data indicates unknown pipeline stages")
+
+        data = data[8:]
+        head = bytes(data[:16])
+
+    if head.startswith(b'XRLE_'):
+        if (_alg is not None) and (_alg != "rle"):
+            raise ValueError("Algorithm mismatch: data indicates RLE, but different algorithm specified")
+
+        _data = run_stage(stats, "decompress", "rle", extended_RLE_decode, data[5:])
+
+    elif (_alg == "rle") or head.startswith(b'RLE_'):
+        if not head.startswith(b'RLE_'):
             raise ValueError("Data does not start with required RLE_ header")
         if (_alg is not None) and (_alg != "rle"):
             raise ValueError("Algorithm mismatch: data indicates RLE, but different algorithm specified")
         
-        _data = RLE_decode(data[4:])
+        _data = run_stage(stats, "decompress", "rle", RLE_decode, data[4:])
+
+    elif head.startswith(b'CHUFFMAN_'):
+        if (_alg is not None) and (_alg != "huffman"):
+            raise ValueError("Algorithm mismatch: data indicates Huffman, but different algorithm specified")
+
+        _data = run_stage(stats, "decompress", "huffman", canonical_huffman_decode, data[9:])
 
-    elif (_alg == "huffman") or data.startswith(b'HUFFMAN_'):
-        if not data.startswith(b'HUFFMAN_'):
+    elif head.startswith(b'MHUFFMAN_'):
+        if (_alg is not None) and (_alg != "huffman"):
+            raise ValueError("Algorithm mismatch: data indicates Huffman, but different algorithm specified")
+
+        _data = run_stage(stats, "decompress", "huffman", multi_table_huffman_decode, data[9:])
+
+    elif head.startswith(b'SHUFFMAN_'):
+        if (_alg is not None) and (_alg != "huffman"):
+            raise ValueError("Algorithm mismatch: data indicates Huffman, but different algorithm specified")
+
+        _data = run_stage(stats, "decompress", "huffman", static_huffman_decode, data[9:])
+
+    elif (_alg == "huffman") or head.startswith(b'HUFFMAN_'):
+        if not head.startswith(b'HUFFMAN_'):
             raise ValueError("Data does not start with required HUFFMAN_ header")
         if (_alg is not None) and (_alg != "huffman"):
             raise ValueError("Algorithm mismatch: data indicates Huffman, but different algorithm specified")
         
-        _data = huffman_decode(data[8:])
+        _data = run_stage(stats, "decompress", "huffman", huffman_decode, data[8:])
+
+    elif head.startswith(b'LZWD_'):
+        if (_alg is not None) and (_alg != "lzw"):
+            raise ValueError("Algorithm mismatch: data indicates LZW, but different algorithm specified")
+        if len(data) < 11:
+            raise ValueError("Incorrect LZWD_ header format")
+        if dictionary is None:
+            raise ValueError("Data was compressed with a preset LZW dictionary, but no lzw_dictionary was given")
+        if dictionary.crc != int.from_bytes(data[7:11], byteorder='big'):
+            raise ValueError("Given lzw_dictionary does not match the one the data was compressed with")
+
+        _data = run_stage(stats, "decompress", "lzw", lzw_decompress, data[11:], max_code_width=data[5], reset=bool(data[6]),
+                          dictionary=dictionary)
 
-    elif (_alg == "lzw") or data.startswith(b'LZW_'):
-        if not data.startswith(b'LZW_'):
+    elif head.startswith(b'LZWA_'):
+        if (_alg is not None) and (_alg != "lzw"):
+            raise ValueError("Algorithm mismatch: data indicates LZW, but different algorithm specified")
+        if len(data) < 7:
+            raise ValueError("Incorrect LZWA_ header format")
+
+        _data = run_stage(stats, "decompress", "lzw", lzw_decompress, data[7:], max_code_width=data[5], reset=bool(data[6]))
+
+    elif (_alg == "lzw") or head.startswith(b'LZW_'):
+        if not head.startswith(b'LZW_'):
             raise ValueError("Data does not start with required LZW_ header")
         if (_alg is not None) and (_alg != "lzw"):
             raise ValueError("Algorithm mismatch: data indicates LZW, but different algorithm specified")
 
-        _data = lzw_decompress(data[4:])
+        _data = run_stage(stats, "decompress", "lzw", lzw_decompress, data[4:])
     
     else:
         raise ValueError("Unknown compression algorithm")
 
 
+    if stages is not None:
+        for key, flag, name, param in STAGE_NAMES:
+            if key in _options and bool(_options[key]) != bool(stages & flag):
+                applied = "applied" if stages & flag else "not applied"
+                raise ValueError(f"Data indicates {name} {applied}, but {param} parameter is {bool(_options[key])}")
+
+        if stages & STAGE_ZRLE:
+            _data = run_stage(stats, "decompress", "zrle", zero_run_decode, _data)
+        if stages & STAGE_MTF:
+            _data = run_stage(stats, "decompress", "mtf", inverse_MTF, _data, MTF_ALPH)
+        if stages & STAGE_BWT:
+            _data = run_stage(stats, "decompress", "bwt", bwt_decode_blocks, _data)
+
+        return bytes(_data)
+
+    # Streams without STAGES_ use the original format, which tags MTF and BWT
+    # inside the decoded data and has no zero-run stage.
+    if "zrle" in _options and _options["zrle"]:
+        raise ValueError("Data indicates zero-run coding not applied, but ZRLE parameter is True")
+
     if ("mtf" in _options and _options["mtf"]) or _data.startswith(b'MTF_'):
         if not _data.startswith(b'MTF_'):
             raise ValueError("Decoded data does not start with required MTF_ header")
         if ("mtf" in _options and not _options["mtf"]):
             raise ValueError("Data indicates MTF applied, but MTF parameter is False")
-        
-        _data = inverse_MTF(_data[4:], MTF_ALPH)
-    
+
+        _data = run_stage(stats, "decompress", "mtf", inverse_MTF, _data[4:], MTF_ALPH)
+
     bwt_padding_size = 0
     if ("bwt" in _options and _options["bwt"]) or _data.startswith(b'BWT_'):
         if not _data.startswith(b'BWT_'):
             raise ValueError("Decoded data does not start with required BWT_ header")
         if ("bwt" in _options and not _options["bwt"]):
             raise ValueError("Data indicates BWT applied, but BWT parameter is False")
-        
+
         _data = _data[4:]
 
         idx_size = int(ceil(BWT_BLOCK_SIZE.bit_length() / 8))
@@ -133,13 +482,351 @@ def decompress(data: bytes, alg: Literal["RLE", "Huffman", "LZW"] | None = None,
         if len(_data) % block_size != 0:
             raise ValueError("Data length is not a multiple of BWT block size")
         
-        new_data = bytearray()
+        _data = run_stage(stats, "decompress", "bwt", inverse_BWT_blocks, bytes(_data), BWT_BLOCK_SIZE, idx_size)
+
+    return bytes(_data[:-bwt_padding_size] if bwt_padding_size > 0 else _data)
+
+
+STREAM_CHUNK_SIZE = 2 ** 20
+STREAM_FRAME_SIZE_BYTES = 4
+
+
+def read_exactly(src, n: int) -> bytes:
+    chunk = bytearray()
+
+    while len(chunk) < n:
+        part = src.read(n - len(chunk))
+        if not part:
+            break
+        chunk.extend(part)
+
+    return bytes(chunk)
+
+
+def read_chunks(src, chunk_size: int):
+    while True:
+        chunk = read_exactly(src, chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def view_chunks(data, chunk_size: int):
+    if chunk_size <= 0:
+        raise ValueError("Chunk size must be positive")
+
+    view = memoryview(data).cast('B')
+    for i in range(0, len(view), chunk_size):
+        yield view[i:i+chunk_size]
+
+
+def read_frames(src):
+    while True:
+        size_bytes = read_exactly(src, STREAM_FRAME_SIZE_BYTES)
+        if len(size_bytes) != STREAM_FRAME_SIZE_BYTES:
+            raise ValueError("Stream ended before the closing frame")
+
+        size = int.from_bytes(size_bytes, byteorder='big')
+        if size == 0:
+            return
+
+        frame = read_exactly(src, size)
+        if len(frame) != size:
+            raise ValueError("Stream ended in the middle of a frame")
+
+        yield frame
+
+
+def view_frames(view):
+    i = 0
+    while True:
+        if i + STREAM_FRAME_SIZE_BYTES > len(view):
+            raise ValueError("Stream ended before the closing frame")
+
+        size = int.from_bytes(view[i:i+STREAM_FRAME_SIZE_BYTES], byteorder='big')
+        i += STREAM_FRAME_SIZE_BYTES
+        if size == 0:
+            return
+
+        if i + size > len(view):
+            raise ValueError("Stream ended in the middle of a frame")
+
+        yield view[i:i+size]
+        i += size
+
+
+def map_ordered(func, items, workers: int = 1, **kwargs):
+    if workers is None or workers <= 1:
+        for item in items:
+            yield func(*item, **kwargs)
+        return
+
+    # At most 2 * workers blocks are in flight, so memory stays bounded while
+    # every worker has a block queued behind the one it is working on.
+    # Workers get the static Huffman tables registered here, which spawned
+    # processes would not otherwise see.
+    with ProcessPoolExecutor(max_workers=workers, initializer=register_huffman_tables,
+                             initargs=(registered_huffman_tables(),)) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, *item, **kwargs))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_frames(chunks, dst, alg: Literal["RLE", "Huffman", "LZW"], workers: int = 1, **options) -> int:
+    if workers is not None and workers > 1:
+        # memoryview slices cannot be sent to worker processes
+        chunks = (bytes(chunk) for chunk in chunks)
+
+    written = 0
+    for frame in map_ordered(compress, ((chunk, alg) for chunk in chunks), workers, **options):
+        dst.write(len(frame).to_bytes(STREAM_FRAME_SIZE_BYTES, byteorder='big'))
+        dst.write(frame)
+        written += STREAM_FRAME_SIZE_BYTES + len(frame)
+
+    dst.write(bytes(STREAM_FRAME_SIZE_BYTES))
+
+    return written + STREAM_FRAME_SIZE_BYTES
+
+
+# A stream is b'STREAM_' followed by frames, each a 4-byte big-endian length and
+# the compress() output of one chunk of the input, and ends with an empty frame.
+# Every chunk is compressed independently, so memory use depends only on
+# chunk_size and workers, never on the size of the input, and chunks can be
+# spread over a process pool.
+def compress_stream(src, dst, alg: Literal["RLE", "Huffman", "LZW"], chunk_size: int = STREAM_CHUNK_SIZE,
+                    workers: int = 1, **options) -> int:
+    if chunk_size <= 0:
+        raise ValueError("Chunk size must be positive")
+
+    dst.write(b'STREAM_')
+
+    return 7 + write_frames(read_chunks(src, chunk_size), dst, alg, workers, **options)
+
+
+def decompress_stream(src, dst, workers: int = 1, **options) -> int:
+    if read_exactly(src, 7) != b'STREAM_':
+        raise ValueError("Data does not start with required STREAM_ header")
+
+    written = 0
+
+    frames = ((frame,) for frame in read_frames(src))
+    for chunk in map_ordered(decompress, frames, workers, **options):
+        dst.write(chunk)
+        written += len(chunk)
+
+    return written
+
+
+
+def open_mapped(f):
+    if os.fstat(f.fileno()).st_size == 0:
+        return memoryview(b'')
+
+    return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+# The input file is memory-mapped and handed to the codecs as memoryview
+# slices, so it is never read into memory as a whole; only the compressed or
+# decompressed chunk currently being written is held.
+def compress_file(src_path: str, dst_path: str, alg: Literal["RLE", "Huffman", "LZW"],
+                  chunk_size: int = STREAM_CHUNK_SIZE, workers: int = 1, **options) -> int:
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        view = open_mapped(src)
+        try:
+            dst.write(b'STREAM_')
+            return 7 + write_frames(view_chunks(view, chunk_size), dst, alg, workers, **options)
+        finally:
+            view.release()
+
+
+def decompress_file(src_path: str, dst_path: str, workers: int = 1, **options) -> int:
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        view = open_mapped(src)
+        try:
+            if bytes(view[:7]) != b'STREAM_':
+                data = decompress(view, **options)
+                dst.write(data)
+                return len(data)
+
+            written = 0
+            frames = ((frame,) for frame in view_frames(view[7:]))
+            if workers is not None and workers > 1:
+                frames = ((bytes(frame),) for (frame,) in frames)
+
+            for chunk in map_ordered(decompress, frames, workers, **options):
+                dst.write(chunk)
+                written += len(chunk)
+
+            return written
+        finally:
+            view.release()
+
+
+
+CONTAINER_MAGIC = b'ENCX'
+CONTAINER_VERSION = 1
+CONTAINER_TRAILER_SIZE = 20
+CONTAINER_INDEX_ENTRY_SIZE = 20
+
+
+def pipeline_descriptor(alg: str, **options) -> bytes:
+    fields = [f"alg={str(alg).lower()}"]
+    fields.extend(f"{str(key).lower()}={value}" for key, value in sorted(options.items(), key=lambda item: str(item[0]).lower()))
+
+    return ",".join(fields).encode("ascii")
+
+
+# Container layout (all integers big-endian):
+#   header   MAGIC | version (1) | block size (4) | descriptor length (2) | descriptor
+#   blocks   compress() output of every block, back to back
+#   index    per block: offset (8) | compressed size (4) | uncompressed size (4) | CRC32 (4)
+#   trailer  index offset (8) | block count (4) | index CRC32 (4) | MAGIC
+# The descriptor records the options the blocks were compressed with. Blocks
+# are decoded with the algorithm and stages it names, and a block whose own
+# tags disagree with it is rejected.
+def compress_container(data, alg: Literal["RLE", "Huffman", "LZW"], chunk_size: int = STREAM_CHUNK_SIZE,
+                       workers: int = 1, stats=None, **options) -> bytes:
+    descriptor = pipeline_descriptor(alg, **options)
+    if len(descriptor) >= 2 ** 16:
+        raise ValueError("Pipeline descriptor is too long")
+
+    out = bytearray(CONTAINER_MAGIC)
+    out.append(CONTAINER_VERSION)
+    out.extend(chunk_size.to_bytes(4, byteorder='big'))
+    out.extend(len(descriptor).to_bytes(2, byteorder='big'))
+    out.extend(descriptor)
+
+    chunks = list(view_chunks(data, chunk_size))
+    items = ((bytes(chunk) if workers is not None and workers > 1 else chunk, alg) for chunk in chunks)
+
+    index = bytearray()
+    for chunk, block in zip(chunks, map_ordered(compress, items, workers, stats=stats, **options)):
+        index.extend(len(out).to_bytes(8, byteorder='big'))
+        index.extend(len(block).to_bytes(4, byteorder='big'))
+        index.extend(len(chunk).to_bytes(4, byteorder='big'))
+        index.extend(zlib.crc32(chunk).to_bytes(4, byteorder='big'))
+        out.extend(block)
+
+    index_offset = len(out)
+    out.extend(index)
+    out.extend(index_offset.to_bytes(8, byteorder='big'))
+    out.extend(len(chunks).to_bytes(4, byteorder='big'))
+    out.extend(zlib.crc32(index).to_bytes(4, byteorder='big'))
+    out.extend(CONTAINER_MAGIC)
+
+    return bytes(out)
+
+
+def read_container_index(data) -> list:
+    view = memoryview(data).cast('B')
+
+    if bytes(view[:4]) != CONTAINER_MAGIC or bytes(view[-4:]) != CONTAINER_MAGIC:
+        raise ValueError("Data is not an ENCX container")
+    if view[4] != CONTAINER_VERSION:
+        raise ValueError(f"Unsupported container version: {view[4]}")
+
+    trailer = view[-CONTAINER_TRAILER_SIZE:]
+    index_offset = int.from_bytes(trailer[:8], byteorder='big')
+    n_blocks = int.from_bytes(trailer[8:12], byteorder='big')
+    index_crc = int.from_bytes(trailer[12:16], byteorder='big')
+
+    index = view[index_offset:index_offset + n_blocks * CONTAINER_INDEX_ENTRY_SIZE]
+    if index_offset + len(index) != len(view) - CONTAINER_TRAILER_SIZE:
+        raise ValueError("Container index does not match its trailer")
+    if zlib.crc32(index) != index_crc:
+        raise RuntimeError("Container index is corrupted")
+
+    blocks = []
+    start = 0
+    for k in range(n_blocks):
+        entry = index[k * CONTAINER_INDEX_ENTRY_SIZE:(k + 1) * CONTAINER_INDEX_ENTRY_SIZE]
+        offset = int.from_bytes(entry[:8], byteorder='big')
+        size = int.from_bytes(entry[8:12], byteorder='big')
+        length = int.from_bytes(entry[12:16], byteorder='big')
+        crc = int.from_bytes(entry[16:20], byteorder='big')
+
+        if offset + size > index_offset:
+            raise ValueError("Container block exceeds data length")
+
+        blocks.append((start, length, offset, size, crc))
+        start += length
+
+    return blocks
+
+
+def parse_descriptor(view) -> dict:
+    size = int.from_bytes(view[9:11], byteorder='big')
+    fields = bytes(view[11:11+size]).decode("ascii").split(",")
+
+    return dict(field.split("=", 1) for field in fields if field)
+
+
+def read_container_descriptor(data) -> dict:
+    view = memoryview(data).cast('B')
+    read_container_index(view)
+
+    return parse_descriptor(view)
+
+
+def descriptor_options(descriptor: dict) -> dict:
+    alg = descriptor.get("alg")
+    if alg is None:
+        raise ValueError("Container descriptor does not name an algorithm")
+
+    # With alg=auto every block picked its own pipeline and carries it in its tags
+    if alg == "auto":
+        return {}
+
+    options = {"alg": alg}
+    for key, _, _, _ in STAGE_NAMES:
+        options[key] = descriptor.get(key, "False") not in ("False", "0", "None", "")
+
+    return options
+
+
+def decode_container_block(block, length: int, crc: int, k: int, **options) -> bytes:
+    chunk = decompress(block, **options)
+
+    if len(chunk) != length or zlib.crc32(chunk) != crc:
+        raise RuntimeError(f"CRC mismatch in container block {k}")
+
+    return chunk
+
+
+def decompress_container(data, workers: int = 1, **options) -> bytes:
+    return decompress_range(data, 0, None, workers, **options)
+
+
+def decompress_range(data, start: int, length: int | None, workers: int = 1, **options) -> bytes:
+    if start < 0 or (length is not None and length < 0):
+        raise ValueError("Range start and length must be non-negative")
+
+    view = memoryview(data).cast('B')
+    blocks = read_container_index(view)
+    options.update(descriptor_options(parse_descriptor(view)))
+
+    end = blocks[-1][0] + blocks[-1][1] if blocks else 0
+    if length is not None:
+        end = min(end, start + length)
+
+    # Only blocks overlapping [start, end) are decoded.
+    needed = [(k, b) for k, b in enumerate(blocks) if b[0] < end and b[0] + b[1] > start]
+    if not needed:
+        return bytes()
 
-        for i in range(0, len(_data), block_size):
-            new_data.extend(
-                inverse_BWT(_data[i:i+block_size], idx_size)
-            )
+    items = []
+    for k, (_, block_length, offset, size, crc) in needed:
+        block = view[offset:offset+size]
+        items.append((bytes(block) if workers is not None and workers > 1 else block, block_length, crc, k))
 
-        _data = new_data
+    out = bytearray()
+    for chunk in map_ordered(decode_container_block, items, workers, **options):
+        out.extend(chunk)
 
-    return bytes(_data[:-bwt_padding_size] if bwt_padding_size > 0 else _data)
\ No newline at end of file
+    first = needed[0][1][0]
+    return bytes(out[start - first:end - first])
@@ -1,58 +1,166 @@
-import os
-import time
-from helpers import read_bin_file_data
+import argparse
+import csv
+import random
+import statistics
+import tracemalloc
+from time import perf_counter
 from compression import compress, decompress
-import pandas as pd
-import matplotlib.pyplot as plt
-import numpy as np
-
-data_table = pd.DataFrame(columns=["Algorithm", "File Type", "MTF", "BWT",
-                             "Compression Ratio mean", "Compression Ratio std", "Encoding Speed mean", "Encoding Speed std"])
-
-directory = "Test Files"
-for alg in ["RLE", "Huffman", "LZW"]:
-    for ext in ["bmp"]:
-        for mtf in [True, False]:
-            for bwt in [True, False]:
-                compression_ratio = []
-                encoding_speed = []
-                for filename in os.listdir(f"{directory}/{ext}"):
-                    filepath = f"{directory}/{ext}/{filename}"
-                    if os.path.isfile(filepath):
-                        data = read_bin_file_data(filepath)
-
-                        og_len = len(data)
-                        es_time = time.time()
-                        encoded_data = compress(
-                            data,
-                            alg=alg,
-                            bwt=bwt,
-                            mtf=mtf
-                        )
-                        encoding_speed.append(
-                            og_len / (1024*1024*(time.time() - es_time))
-                        ) 
-                        
-                        enc_len = len(encoded_data)
-                        decoded_data = decompress(encoded_data)
-     
-                        if (data == decoded_data):
-                            print(enc_len / og_len)
-                        else:
-                            print(f"Error in file: {filepath}")
-
-                        compression_ratio.append(enc_len / og_len)
-                
-                row_entry = {
-                    "Algorithm": [alg],
-                    "File Type": [ext],
-                    "MTF": [mtf],
-                    "BWT": [bwt],
-                    "Compression Ratio mean": [np.mean(compression_ratio)],
-                    "Compression Ratio std": [np.std(compression_ratio)],
-                    "Encoding Speed mean": [np.mean(encoding_speed)],
-                    "Encoding Speed std": [np.std(encoding_speed)],
-                }
-
-                data_table = pd.concat([data_table, pd.DataFrame.from_dict(row_entry)], ignore_index=True)
-                data_table.to_csv("bmp.csv", index=False) 
\ No newline at end of file
+
+
+ALGORITHMS = ["RLE", "Huffman", "LZW"]
+CORPUS_KINDS = ["text", "bitmap", "random", "repetitive"]
+SIZES = [2 ** 14, 2 ** 17]
+N_RUNS = 5
+N_WARMUP = 1
+SEED = 2024
+
+FIELDS = ["Algorithm", "Corpus", "Size", "MTF", "BWT", "Compression Ratio",
+          "Encoding Speed mean", "Encoding Speed std", "Decoding Speed mean", "Decoding Speed std",
+          "Encoding Peak Memory", "Decoding Peak Memory"]
+
+
+def generate_text(rng: random.Random, size: int) -> bytes:
+    alphabet = "etaoinshrdlucmfwypvbgkqjxz"
+    words = ["".join(rng.choice(alphabet[:rng.randint(8, 26)]) for _ in range(rng.randint(1, 9))) for _ in range(2000)]
+    weights = [1 / (k + 1) for k in range(len(words))]
+
+    out = bytearray()
+    while len(out) < size:
+        sentence = " ".join(rng.choices(words, weights, k=rng.randint(4, 18)))
+        out.extend(sentence.capitalize().encode("ascii") + rng.choice([b". ", b". ", b"? ", b".\n"]))
+
+    return bytes(out[:size])
+
+
+def generate_bitmap(rng: random.Random, size: int) -> bytes:
+    # 24-bit rows of flat regions, gradients and a little sensor noise
+    width = 256
+    out = bytearray()
+    while len(out) < size:
+        kind = rng.random()
+        color = [rng.randrange(256) for _ in range(3)]
+        for _ in range(rng.randint(1, 32)):
+            row = bytearray()
+            for x in range(width):
+                if kind < 0.5:
+                    pixel = color
+                elif kind < 0.8:
+                    pixel = [(c + x) % 256 for c in color]
+                else:
+                    pixel = [min(255, max(0, c + rng.randint(-3, 3))) for c in color]
+                row.extend(pixel)
+            out.extend(row)
+
+    return bytes(out[:size])
+
+
+def generate_random(rng: random.Random, size: int) -> bytes:
+    return rng.randbytes(size)
+
+
+def generate_repetitive(rng: random.Random, size: int) -> bytes:
+    pattern = bytearray(rng.randbytes(rng.randint(16, 64)))
+
+    out = bytearray()
+    while len(out) < size:
+        if rng.random() < 0.05:
+            pattern[rng.randrange(len(pattern))] = rng.randrange(256)
+        out.extend(pattern)
+
+    return bytes(out[:size])
+
+
+GENERATORS = {
+    "text": generate_text,
+    "bitmap": generate_bitmap,
+    "random": generate_random,
+    "repetitive": generate_repetitive,
+}
+
+
+def generate_corpus(kinds=CORPUS_KINDS, sizes=SIZES, seed: int = SEED) -> list:
+    corpus = []
+    for kind in kinds:
+        for size in sizes:
+            rng = random.Random(f"{seed}-{kind}-{size}")
+            corpus.append((kind, size, GENERATORS[kind](rng, size)))
+
+    return corpus
+
+
+def time_runs(func, n_runs: int = N_RUNS, n_warmup: int = N_WARMUP) -> list:
+    for _ in range(n_warmup):
+        func()
+
+    times = []
+    for _ in range(n_runs):
+        start = perf_counter()
+        func()
+        times.append(perf_counter() - start)
+
+    return times
+
+
+def peak_memory(func) -> int:
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark(data: bytes, alg: str, mtf: bool, bwt: bool, n_runs: int = N_RUNS, n_warmup: int = N_WARMUP) -> dict:
+    encoded_data = compress(data, alg=alg, mtf=mtf, bwt=bwt)
+    if decompress(encoded_data) != data:
+        raise RuntimeError(f"Round trip failed for {alg}, MTF={mtf}, BWT={bwt}")
+
+    mb = len(data) / (1024 * 1024)
+    encoding_speed = [mb / t for t in time_runs(lambda: compress(data, alg=alg, mtf=mtf, bwt=bwt), n_runs, n_warmup)]
+    decoding_speed = [mb / t for t in time_runs(lambda: decompress(encoded_data), n_runs, n_warmup)]
+
+    return {
+        "Compression Ratio": len(encoded_data) / len(data),
+        "Encoding Speed mean": statistics.mean(encoding_speed),
+        "Encoding Speed std": statistics.pstdev(encoding_speed),
+        "Decoding Speed mean": statistics.mean(decoding_speed),
+        "Decoding Speed std": statistics.pstdev(decoding_speed),
+        "Encoding Peak Memory": peak_memory(lambda: compress(data, alg=alg, mtf=mtf, bwt=bwt)),
+        "Decoding Peak Memory": peak_memory(lambda: decompress(encoded_data)),
+    }
+
+
+def run(output: str, algorithms=ALGORITHMS, kinds=CORPUS_KINDS, sizes=SIZES,
+        n_runs: int = N_RUNS, n_warmup: int = N_WARMUP, seed: int = SEED):
+    corpus = generate_corpus(kinds, sizes, seed)
+
+    with open(output, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+
+        for alg in algorithms:
+            for kind, size, data in corpus:
+                for mtf in [True, False]:
+                    for bwt in [True, False]:
+                        row = {"Algorithm": alg, "Corpus": kind, "Size": size, "MTF": mtf, "BWT": bwt}
+                        row.update(benchmark(data, alg, mtf, bwt, n_runs, n_warmup))
+                        writer.writerow(row)
+                        f.flush()
+
+                        print(f"{alg:8} {kind:10} {size:8} MTF={mtf!s:5} BWT={bwt!s:5} "
+                              f"ratio={row['Compression Ratio']:.3f} "
+                              f"enc={row['Encoding Speed mean']:.2f} MB/s dec={row['Decoding Speed mean']:.2f} MB/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every alg x MTF x BWT pipeline on a synthetic corpus")
+    parser.add_argument("--output", default="benchmark_results.csv")
+    parser.add_argument("--algorithms", nargs="+", default=ALGORITHMS)
+    parser.add_argument("--corpus", nargs="+", default=CORPUS_KINDS, choices=CORPUS_KINDS)
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES)
+    parser.add_argument("--runs", type=int, default=N_RUNS)
+    parser.add_argument("--warmup", type=int, default=N_WARMUP)
+    parser.add_argument("--seed", type=int, default=SEED)
+    args = parser.parse_args()
+
+    run(args.output, args.algorithms, args.corpus, args.sizes, args.runs, args.warmup, args.seed)
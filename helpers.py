@@ -1,64 +1,335 @@
 import os
-import copy
 from typing import Iterable
-from numpy import argsort, ceil, frombuffer, roll, lexsort, uint8, array, argwhere
+from numpy import argsort, ceil, frombuffer, lexsort, take, uint8, int32, int64, arange, empty, zeros, cumsum, flatnonzero, \
+    full, tile, where, bincount, maximum, equal, less, not_equal, count_nonzero
 
 
 
-def MTF(block: bytes, alphabet: Iterable):
-    current_alph = [a for a in alphabet]
+# Repeats of the front symbol code as 0 and leave the list alone, so only the
+# other positions go through the list. Small blocks (and alphabets that are
+# not a permutation of all 256 bytes) run the list as a bytearray: finding a
+# symbol is a C-level scan and moving it to the front is a single memmove.
+# Larger blocks are cut into MTF_BATCH_ROWS rows that are stepped together
+# over NumPy rank arrays, one window of MTF_WINDOW_SIZE bytes at a time.
+# Decoding a step costs about one rank column per symbol that can move; a
+# window of mostly large indices (random data) decodes faster in the loop,
+# which costs about MTF_LOOP_COLUMNS columns per byte.
+MTF_BATCH_ROWS = 2 ** 10
+MTF_BATCH_MIN_SIZE = 2 ** 16
+MTF_WINDOW_SIZE = 2 ** 18
+MTF_LOOP_COLUMNS = 192
+
+
+def _is_byte_permutation(alphabet: bytearray) -> bool:
+    return len(alphabet) == 256 and len(set(alphabet)) == 256
+
+
+def _batch_shape(n: int):
+    row_length = -(-n // MTF_BATCH_ROWS)
+    return -(-n // row_length), row_length
+
+
+def _step_columns(columns, n_rows: int, row_length: int, padding: int = 0):
+    # Column t holds the t-th entry of every row; the last row is padded.
+    steps = full(n_rows * row_length, padding, dtype=columns.dtype)
+    steps[:len(columns)] = columns
+    return steps.reshape(n_rows, row_length).T.copy()
+
+
+def _MTF_loop(block: bytes, current_alph: bytearray):
+    find = current_alph.index
 
     new_block = bytearray(len(block))
+    front = current_alph[0] if current_alph else None
     for i, b in enumerate(block):
-        idx = current_alph.index(b)
+        if b == front:
+            continue
+
+        idx = find(b)
         new_block[i] = idx
-        current_alph.insert(0, current_alph.pop(idx))
+        del current_alph[idx]
+        current_alph.insert(0, b)
+        front = b
 
     return new_block
 
 
-def inverse_MTF(block: bytes, alphabet: Iterable):
-    current_alph = [int(a) for a in alphabet]
+def _MTF_window(data, current_alph):
+    # The list at the start of each row is known up front: symbols seen in
+    # earlier rows by their last occurrence, most recent first, then the rest
+    # in current_alph order. Every row then only tracks the ranks of the
+    # symbols that occur in the window.
+    changed = empty(len(data), dtype=bool)
+    changed[0] = data[0] != current_alph[0]
+    not_equal(data[1:], data[:-1], out=changed[1:])
+    starts = flatnonzero(changed)
+    symbols = data[starts]
+    n = len(symbols)
+
+    new_block = zeros(len(data), dtype=uint8)
+    if n == 0:
+        return new_block
+
+    n_rows, row_length = _batch_shape(n)
+    positions = arange(n, dtype=int32)
+    row_last = full((n_rows, 256), -1, dtype=int32)
+    maximum.at(row_last.reshape(-1), positions // row_length * 256 + symbols, positions)
+
+    last = empty((n_rows + 1, 256), dtype=int32)
+    last[0] = -1
+    maximum.accumulate(row_last, axis=0, out=last[1:])
+    position_in_alph = empty(256, dtype=int32)
+    position_in_alph[current_alph] = arange(256, dtype=int32)
+    order = argsort(where(last >= 0, -last, n + position_in_alph), axis=1)
+
+    present = flatnonzero(bincount(symbols, minlength=256))
+    width = len(present)
+    column = zeros(256, dtype=int32)
+    column[present] = arange(width, dtype=int32)
+    ranks = empty((n_rows, 256), dtype=uint8)
+    ranks[arange(n_rows)[:, None], order[:-1]] = arange(256, dtype=uint8)
+    ranks = ranks.take(present, axis=1)
+    flat_ranks = ranks.reshape(-1)
+
+    # Padding moves a symbol of the last row after its real entries.
+    steps = _step_columns(positions // row_length * width + column[symbols], n_rows, row_length,
+                          (n_rows - 1) * width)
+    indices = empty((row_length, n_rows), dtype=uint8)
+    moved = empty((n_rows, width), dtype=bool)
+    for t in range(row_length):
+        idx = indices[t]
+        take(flat_ranks, steps[t], out=idx)
+        less(ranks, idx[:, None], out=moved)
+        ranks += moved
+        flat_ranks[steps[t]] = 0
+
+    current_alph[:] = order[-1]
+    new_block[starts] = indices.T.reshape(-1)[:n]
+    return new_block
+
+
+def MTF(block: bytes, alphabet: Iterable):
+    current_alph = bytearray(alphabet)
+    if len(block) < MTF_BATCH_MIN_SIZE or not _is_byte_permutation(current_alph):
+        return _MTF_loop(block, current_alph)
+
+    data = frombuffer(block, dtype=uint8)
+    current_alph = frombuffer(current_alph, dtype=uint8).copy()
+    new_block = bytearray()
+    for begin in range(0, len(data), MTF_WINDOW_SIZE):
+        new_block += _MTF_window(data[begin:begin + MTF_WINDOW_SIZE], current_alph).tobytes()
 
+    return new_block
+
+
+def _inverse_MTF_loop(block: bytes, current_alph: bytearray):
     new_block = bytearray(len(block))
+    front = current_alph[0] if current_alph else 0
     for i, b in enumerate(block):
-        new_block[i] = current_alph[b]
-        current_alph.insert(0, current_alph.pop(b))
+        if b:
+            front = current_alph[b]
+            del current_alph[b]
+            current_alph.insert(0, front)
+
+        new_block[i] = front
+
+    return new_block
+
+
+def _inverse_MTF_window(data, current_alph):
+    # The list at the start of a row is not known until the rows before it
+    # are decoded, so every row is decoded from the identity list instead:
+    # the labels it yields, read through the row's real starting list, are
+    # the symbols, and that list is the previous row's list permuted by the
+    # previous row's final label order. Only labels below the largest index
+    # ever move.
+    nonzero = flatnonzero(data)
+    indices = data[nonzero]
+    n = len(indices)
+
+    symbols = empty(n + 1, dtype=uint8)
+    symbols[0] = current_alph[0]
+    if n:
+        n_rows, row_length = _batch_shape(n)
+        width = int(indices.max()) + 1
+        ranks = tile(arange(width, dtype=uint8), (n_rows, 1))
+        flat_ranks = ranks.reshape(-1)
+        row_offsets = arange(n_rows, dtype=int32) * width
+
+        steps = _step_columns(indices, n_rows, row_length)
+        labels = empty((row_length, n_rows), dtype=uint8)
+        moved = empty((n_rows, width), dtype=bool)
+        for t in range(row_length):
+            idx = steps[t][:, None]
+            equal(ranks, idx, out=moved)
+            label = moved.argmax(axis=1)
+            labels[t] = label
+            less(ranks, idx, out=moved)
+            ranks += moved
+            flat_ranks[row_offsets + label] = 0
+
+        final_labels = empty((n_rows, width), dtype=uint8)
+        final_labels[arange(n_rows)[:, None], ranks] = arange(width, dtype=uint8)
+        row_alph = empty((n_rows, 256), dtype=uint8)
+        for k in range(n_rows):
+            row_alph[k] = current_alph
+            current_alph[:width] = current_alph[final_labels[k]]
+
+        symbols[1:] = row_alph[arange(n_rows)[:, None], labels.T].reshape(-1)[:n]
+
+    fill = zeros(len(data), dtype=int32)
+    fill[nonzero] = arange(1, n + 1, dtype=int32)
+    maximum.accumulate(fill, out=fill)
+    return symbols[fill]
+
+
+def inverse_MTF(block: bytes, alphabet: Iterable):
+    current_alph = bytearray(alphabet)
+    if len(block) < MTF_BATCH_MIN_SIZE or not _is_byte_permutation(current_alph):
+        return _inverse_MTF_loop(block, current_alph)
+
+    data = frombuffer(block, dtype=uint8)
+    current_alph = frombuffer(current_alph, dtype=uint8).copy()
+    new_block = bytearray()
+    for begin in range(0, len(data), MTF_WINDOW_SIZE):
+        window = data[begin:begin + MTF_WINDOW_SIZE]
+        if count_nonzero(window) * int(window.max()) < MTF_LOOP_COLUMNS * len(window):
+            new_block += _inverse_MTF_window(window, current_alph).tobytes()
+        else:
+            loop_alph = bytearray(current_alph)
+            new_block += _inverse_MTF_loop(memoryview(window), loop_alph)
+            current_alph[:] = frombuffer(loop_alph, dtype=uint8)
 
     return new_block
 
 
+def cyclic_suffix_array(block: bytes):
+    # Prefix doubling over the cyclic string: after the round with step k,
+    # rank[s] orders the rotations starting at s by their first 2k bytes.
+    # Ranks are int32 and keys only as wide as rank * base needs; the key and
+    # sorted-key buffers are reused by every round.
+    N = len(block)
+    base = max(N, 256)
+    rank_dtype = int32 if N < 2 ** 31 else int64
+    key_dtype = int32 if base * base < 2 ** 31 else int64
+
+    rank = frombuffer(block, dtype=uint8).astype(rank_dtype)
+    key = empty(N, dtype=key_dtype)
+    sorted_key = empty(N, dtype=key_dtype)
+
+    k = 1
+    while k < N:
+        key[:] = rank
+        key *= base
+        key[:-k] += rank[k:]
+        key[-k:] += rank[:k]
+
+        # the previous order is dropped first so two never coexist
+        order = None
+        order = argsort(key, kind='stable')
+        take(key, order, out=sorted_key, mode='clip')
+
+        # sorted_key is free once the boundaries are known and holds the new
+        # ranks in sorted order
+        boundaries = sorted_key[1:] != sorted_key[:-1]
+        sorted_key[0] = 0
+        sorted_key[1:] = boundaries
+        del boundaries
+        cumsum(sorted_key, out=sorted_key)
+        rank[order] = sorted_key
+
+        if sorted_key[-1] == N - 1:
+            # All ranks are distinct, so order already sorts the rotations
+            return order
+        k *= 2
+
+    # Equal rotations (periodic blocks) keep the order of the rotation matrix
+    # rows, i.e. row (N - s) % N for the rotation starting at s.
+    return lexsort(((N - arange(N)) % N, rank))
+
+
 def BWT(block: bytes) -> bytes:
     N = len(block)
     _block = frombuffer(block, dtype=uint8)
-    M = array([roll(_block, i) for i in range(N)])
+    sa = cyclic_suffix_array(block)
 
-    idx = lexsort(M.T[::-1])
+    og_idx = int(flatnonzero(sa == 0)[0])
 
-    og_idx = int(argwhere(idx == 0)[0][0])
-
-    last_column = bytearray(M[idx, -1].tobytes())
+    last_column = bytearray(_block[(sa - 1) % N].tobytes())
     last_column.extend(og_idx.to_bytes(int(ceil(N.bit_length() / 8)), byteorder='big'))
     return bytes(last_column)
 
 
-def inverse_BWT(block: bytes, index_size_bytes: int) -> bytes:
-    N = len(block) - index_size_bytes
-    last_column = block[:N]
-    og_idx = int.from_bytes(block[N:], byteorder='big')
-    
-    sort_idx = argsort(list(last_column), kind='stable')
-    inv_sort_idx = argsort(sort_idx, kind='stable')
+INVERSE_BWT_BATCH_SIZE = 2 ** 22
+
+
+def LF_mapping(last_columns):
+    # LF[i] = C[L[i]] + (occurrences of L[i] in L[:i]), i.e. the rank of i in a
+    # stable sort of the last column. NumPy sorts uint8 keys stably with a
+    # counting (radix) sort, so this is a single O(N) pass per row.
+    B, N = last_columns.shape
+    index_dtype = int32 if B * N < 2 ** 31 else int64
+    order = argsort(last_columns, axis=1, kind='stable')
+
+    lf = empty((B, N), dtype=index_dtype)
+    lf[arange(B)[:, None], order] = arange(N, dtype=index_dtype)
+    del order
+    lf += (arange(B, dtype=index_dtype) * N)[:, None]
+
+    return lf.reshape(-1)
+
+
+def _inverse_BWT_batch(rows, N: int, index_size_bytes: int) -> bytes:
+    B = rows.shape[0]
+    last_columns = rows[:, :N]
+
+    og_idx = zeros(B, dtype=int64)
+    for k in range(N, N + index_size_bytes):
+        og_idx = og_idx * 256 + rows[:, k]
+
+    if (og_idx >= N).any():
+        raise ValueError("BWT index is out of block range")
+
+    # Walk the LF chains of all blocks at once by pointer doubling: with
+    # P = LF^m and the first m chain positions known, P gives the next m.
+    # The chain is filled in place, in the index width of P.
+    P = LF_mapping(last_columns)
+    chain = empty((B, N), dtype=P.dtype)
+    chain[:, 0] = og_idx + arange(B) * N
+    m = 1
+    while m < N:
+        n = min(m, N - m)
+        take(P, chain[:, :n], out=chain[:, m:m+n], mode='clip')
+        m *= 2
+        if m < N:
+            P = P[P]
+    del P
 
-    reconstructed = bytearray(N)
-    idx = og_idx
-    for i in range(N-1, -1, -1):
-        reconstructed[i] = last_column[idx]
-        idx = inv_sort_idx[idx]
+    return last_columns.reshape(-1)[chain][:, ::-1].tobytes()
+
+
+def inverse_BWT_blocks(data: bytes, block_size: int, index_size_bytes: int) -> bytes:
+    stride = block_size + index_size_bytes
+    if block_size <= 0 or len(data) % stride != 0:
+        raise ValueError("Data length is not a multiple of BWT block size")
+
+    rows = frombuffer(data, dtype=uint8).reshape(-1, stride)
+    batch = max(1, INVERSE_BWT_BATCH_SIZE // block_size)
+
+    reconstructed = bytearray()
+    for i in range(0, rows.shape[0], batch):
+        reconstructed.extend(_inverse_BWT_batch(rows[i:i+batch], block_size, index_size_bytes))
 
     return bytes(reconstructed)
 
 
+def inverse_BWT(block: bytes, index_size_bytes: int) -> bytes:
+    N = len(block) - index_size_bytes
+    if N == 0:
+        return bytes()
+
+    return inverse_BWT_blocks(block, N, index_size_bytes)
+
 
 def int_to_bits(n: int, bit_length: int) -> Iterable[bool]:
     if n >= 2 ** bit_length:
@@ -73,82 +344,116 @@ def bits_to_int(B: Iterable[bool]) -> int:
     return int(''.join('1' if b else '0' for b in B), 2)
 
 
+BIT_REVERSE = bytes(int(format(b, "08b")[::-1], 2) for b in range(256))
+BIT_BUFFER_SIZE = 64
+
+
+# Both streams store bits LSB-first within each byte. Internally they keep an
+# integer accumulator in stream order (earliest bit most significant) and move
+# whole bytes in and out of it, using BIT_REVERSE to translate between the two
+# orders in bulk. Multi-bit values are written/read most significant bit first,
+# i.e. write_bits(n, k) is equivalent to write_bits(int_to_bits(n, k)).
 class ReadBitStream:
-    def __init__(self, data: bytes | bytearray):
+    def __init__(self, data: bytes | bytearray | memoryview):
         if isinstance(data, bytes):
             self.data = data
-        elif isinstance(data, bytearray):
-            self.data = copy.deepcopy(data)
         else:
-            raise ValueError(f"Unsupported data type: {type(data)}")
+            try:
+                self.data = memoryview(data).cast('B')
+            except TypeError:
+                raise ValueError(f"Unsupported data type: {type(data)}")
         
-        self.i = 0
-        self.j = 0
-        self.N = len(data) * 8
+        self.pos = 0
+        self.N = len(self.data) * 8
 
-        self._masks = bytes([1, 2, 4, 8, 16, 32, 64, 128])
+        self._acc = 0
+        self._n_acc = 0
+        self._k = 0
 
-        self.eos = False
+        self.eos = (self.N == 0)
 
         pass
 
 
-    def _next(self, k: int = 1):
-        self.j += ((self.i + k) // 8)
-        self.i = (self.i + k) % 8
-        
-        if self.i + 8*self.j >= self.N:
-            self.eos = True
+    @property
+    def i(self) -> int:
+        return self.pos % 8
+
+    @property
+    def j(self) -> int:
+        return self.pos // 8
+
+
+    def _fill(self, k: int):
+        n_bytes = max(BIT_BUFFER_SIZE // 8, (k - self._n_acc + 7) // 8)
+        chunk = self.data[self._k:self._k + n_bytes]
+
+        self._acc = (self._acc << (8 * len(chunk))) | int.from_bytes(bytes(chunk).translate(BIT_REVERSE), byteorder='big')
+        self._n_acc += 8 * len(chunk)
+        self._k += len(chunk)
 
 
     def remaining_bits(self) -> int:
-        return self.N - (self.i + 8*self.j)
+        return self.N - self.pos
 
 
     def read_all_bits(self) -> Iterable[bool]:
-        B = []
+        return self.read_bits(self.remaining_bits())
 
-        while not self.eos:
-            B.append(self.read_bit())
-        
-        return B
+    def read_bits_int(self, k: int) -> int:
+        if self.pos + k > self.N:
+            raise RuntimeError("EOS")
+
+        if self._n_acc < k:
+            self._fill(k)
+
+        self._n_acc -= k
+        value = self._acc >> self._n_acc
+        self._acc &= (1 << self._n_acc) - 1
+
+        self.pos += k
+        self.eos = (self.pos >= self.N)
+
+        return value
 
     def read_bit(self):
         if self.eos:
             raise RuntimeError("EOS")
         
-        b = bool(self.data[self.j] & self._masks[self.i])
-        self._next()
-        
-        return b
+        return bool(self.read_bits_int(1))
 
     def read_byte(self):
-        if self.eos or (self.i + 8*self.j + 8 > self.N):
+        if self.eos or (self.pos + 8 > self.N):
             raise RuntimeError("EOS")
         
-        first = (self.data[self.j] >> self.i) % 256
-        second = (self.data[self.j] << (8 - self.i)) % 256
-
-        self._next(8)
-        
-        return (first | second)
+        return BIT_REVERSE[self.read_bits_int(8)]
     
 
     def read_bits(self, k):
-        B = [False] * k
+        value = self.read_bits_int(k)
 
-        for l in range(k):
-            B[l] = self.read_bit()
-        
-        return B
+        return [bool((value >> (k - 1 - l)) & 1) for l in range(k)]
 
     def read_bytes(self, k):
-        B = bytearray(k)
+        if self.pos + 8 * k > self.N:
+            raise RuntimeError("EOS")
 
-        for l in range(k):
-            B[l] = self.read_byte()
-        
-        return B
+        if self.pos % 8 == 0:
+            beg = self.pos // 8
+            B = bytearray(self.data[beg:beg + k])
+
+            self._acc = 0
+            self._n_acc = 0
+            self._k = beg + k
+
+            self.pos += 8 * k
+            self.eos = (self.pos >= self.N)
+
+            return B
+
+        value = self.read_bits_int(8 * k)
+
+        return bytearray(value.to_bytes(k, byteorder='big').translate(BIT_REVERSE))
     
     
 
@@ -156,32 +461,63 @@ class WriteBitStream:
     def __init__(self):
         self.data = bytearray()
         
-        self.i = 0
-    
-        self._masks = bytes([1, 2, 4, 8, 16, 32, 64, 128])
+        self._acc = 0
+        self._n_acc = 0
 
         pass
 
 
+    def _flush(self):
+        k = self._n_acc // 8
+        if k == 0:
+            return
+
+        self._n_acc -= 8 * k
+        self.data.extend((self._acc >> self._n_acc).to_bytes(k, byteorder='big').translate(BIT_REVERSE))
+        self._acc &= (1 << self._n_acc) - 1
+
 
     def get_data(self):
-        return bytes(self.data)
+        self._flush()
+
+        if self._n_acc == 0:
+            return bytes(self.data)
+
+        tail = (self._acc << (8 - self._n_acc)).to_bytes(1, byteorder='big').translate(BIT_REVERSE)
+        return bytes(self.data) + tail
 
 
     def write_bit(self, b: bool):
         if (b != 0) and (b != 1):
             raise RuntimeError("b must be a bit (0 or 1)")
         
-        if self.i == 0:
-            self.data.append(0)
+        self._acc = (self._acc << 1) | b
+        self._n_acc += 1
+
+        if self._n_acc >= BIT_BUFFER_SIZE:
+            self._flush()
 
-        self.data[-1] = (self.data[-1] | (b << self.i))
-        self.i = (self.i + 1) % 8
 
+    def write_bits(self, bits: Iterable[bool] | int, nbits: int | None = None):
+        if nbits is None:
+            value = 0
+            nbits = 0
+            for b in bits:
+                if (b != 0) and (b != 1):
+                    raise RuntimeError("b must be a bit (0 or 1)")
+                value = (value << 1) | b
+                nbits += 1
 
-    def write_bits(self, bits: Iterable[bool]):
-        for b in bits:
-            self.write_bit(b)
+        else:
+            value = bits
+            if (value < 0) or (value >> nbits):
+                raise ValueError("value is too large to fit in the specified bit length")
+
+        self._acc = (self._acc << nbits) | value
+        self._n_acc += nbits
+
+        if self._n_acc >= BIT_BUFFER_SIZE:
+            self._flush()
         
 
     def write_byte(self, b: int | bytes):
@@ -196,18 +532,22 @@ class WriteBitStream:
         else:
             raise RuntimeError("b must be of type bytes or int")
         
-        self.data.append(0)
-        
-        if self.i == 0:
-            self.data[-1] = bm
-        else:
-            self.data[-2] = (self.data[-2] | ((bm << self.i) % 256))
-            self.data[-1] = (self.data[-1] | ((bm >> (8 - self.i)) % 256))
+        self._acc = (self._acc << 8) | BIT_REVERSE[bm]
+        self._n_acc += 8
+
+        if self._n_acc >= BIT_BUFFER_SIZE:
+            self._flush()
 
 
     def write_bytes(self, B: bytes | bytearray):
-        for b in B:
-            self.write_byte(b)
+        if self._n_acc % 8 == 0:
+            self._flush()
+            self.data.extend(B)
+            return
+
+        value = int.from_bytes(bytes(B).translate(BIT_REVERSE), byteorder='big')
+        self.write_bits(value, 8 * len(B))
+        self._flush()
 
 
 def read_bin_file_data(filepath: str) -> bytes:
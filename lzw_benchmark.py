@@ -0,0 +1,87 @@
+import argparse
+import os
+from experiments import generate_corpus, time_runs, CORPUS_KINDS
+from helpers import read_bin_file_data, int_to_bits, bits_to_int, ReadBitStream, WriteBitStream
+from LZW import lzw_compress, lzw_decompress, FlatTrie, OffsetIDict, MAX_CODE_WIDTH
+
+N_RUNS = 3
+SIZES = [2 ** 20]
+
+
+# The codec before codes were read and written as integers: every code goes
+# through a list of bools. The trie and dictionary are the current ones, so
+# only the code I/O differs from lzw_compress/lzw_decompress.
+def lzw_compress_bool_lists(data: bytes) -> bytes:
+    trie = FlatTrie(2 ** MAX_CODE_WIDTH)
+    output = WriteBitStream()
+
+    for byte in data:
+        res = trie.next(byte)
+
+        if not (res is None):
+            output.write_bits(int_to_bits(res, (trie.n_phrases - 2).bit_length()))
+
+    if trie.current_index is not None:
+        output.write_bits(int_to_bits(trie.current_index, (trie.n_phrases - 1).bit_length()))
+
+    return output.get_data()
+
+
+def lzw_decompress_bool_lists(data: bytes) -> bytes:
+    input = ReadBitStream(data)
+    output = bytearray()
+
+    idict = OffsetIDict(2 ** MAX_CODE_WIDTH)
+    index_bit_length = (idict.n_phrases - 1).bit_length()
+
+    while not (input.remaining_bits() < index_bit_length):
+        idict.next(bits_to_int(input.read_bits(index_bit_length)), output)
+        index_bit_length = idict.n_phrases.bit_length()
+
+    return bytes(output)
+
+
+def read_corpus(directory: str) -> list:
+    corpus = []
+    for root, _, filenames in sorted(os.walk(directory)):
+        for filename in sorted(filenames):
+            filepath = os.path.join(root, filename)
+            data = read_bin_file_data(filepath)
+            corpus.append((os.path.relpath(root, directory), len(data), data))
+
+    return corpus
+
+
+def speed(data: bytes, func, n_runs: int) -> float:
+    return len(data) / (1024 * 1024 * min(time_runs(func, n_runs, 0)))
+
+
+def run(corpus, n_runs: int = N_RUNS):
+    print(f"{'Corpus':12} {'Size':>8}  {'enc bools':>10} {'enc ints':>10} {'':>6}  {'dec bools':>10} {'dec ints':>10}")
+
+    for kind, size, data in corpus:
+        encoded_data = lzw_compress(data)
+        if lzw_compress_bool_lists(data) != encoded_data:
+            raise RuntimeError(f"Bool-list and integer encoders disagree on {kind}")
+        if lzw_decompress(encoded_data) != data or lzw_decompress_bool_lists(encoded_data) != data:
+            raise RuntimeError(f"Round trip failed on {kind}")
+
+        enc_bools = speed(data, lambda: lzw_compress_bool_lists(data), n_runs)
+        enc_ints = speed(data, lambda: lzw_compress(data), n_runs)
+        dec_bools = speed(data, lambda: lzw_decompress_bool_lists(encoded_data), n_runs)
+        dec_ints = speed(data, lambda: lzw_decompress(encoded_data), n_runs)
+
+        print(f"{kind:12} {size:8}  {enc_bools:10.2f} {enc_ints:10.2f} {enc_ints / enc_bools:5.2f}x"
+              f"  {dec_bools:10.2f} {dec_ints:10.2f} {dec_ints / dec_bools:5.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare LZW speed (MB/s, best of N) with bool-list and integer code I/O")
+    parser.add_argument("path", nargs="?", help="directory of test files; a synthetic corpus is generated if omitted")
+    parser.add_argument("--corpus", nargs="+", default=CORPUS_KINDS, choices=CORPUS_KINDS)
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES)
+    parser.add_argument("--runs", type=int, default=N_RUNS)
+    args = parser.parse_args()
+
+    corpus = read_corpus(args.path) if args.path else generate_corpus(args.corpus, args.sizes)
+    run(corpus, args.runs)